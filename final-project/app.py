@@ -1,61 +1,709 @@
+import io
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash
-from pymongo import MongoClient
+import atexit
+import hmac
+import time
+import mimetypes
+import click
+from functools import wraps
+from itertools import groupby
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, session, stream_with_context
+from pymongo import ASCENDING, DESCENDING, TEXT, UpdateOne
+from pymongo.errors import (
+    BulkWriteError, ConnectionFailure, DuplicateKeyError, OperationFailure, PyMongoError
+)
 from bson.objectid import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from dotenv import load_dotenv
-
-# --- Load Environment Variables ---
-load_dotenv()
+from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from image_derivatives import picture_sources, DERIVED_DIR
+from static_assets import build_assets, fingerprinted_path, precompressed_variant, encodings_by_path, ASSETS_DIR
+from page_cache import PageCache, LRUBackend
+from write_behind import WriteBehindBuffer
+from metrics import RequestMetrics
+from mongo_client import MongoConnection
+from shared import (
+    parse_object_ids, FORUM_PAGE_SIZE, FORUM_EXCERPT_LENGTH, FORUM_LIST_PROJECTION, encode_cursor,
+    decode_cursor, keyset_filter, VERSION_INC, VERSION_BUMP, HISTORY_PAGE_SIZE, initial_care_stats,
+    care_stats_update, care_stats_summary, CARE_EVENTS_STORAGE, month_start, bucket_upsert,
+    SPECIES_CATALOG, SPECIES_IMAGES, DEFAULT_IMAGE, MS_PER_DAY, watering_interval, next_due_date,
+    IMAGE_CACHE_MAX_AGE, build_image_manifest, startup_image_manifest, startup_asset_manifest,
+    PASSWORD_HASH_METHOD, HASH_TIMEOUT, HASHING_FORM_TEMPLATES, HashingOverloaded, get_hash_executor,
+    discard_hash_executor, submit_hash_job, needs_rehash, User, UserCache, PLANTS_PAGE_SIZE,
+    parse_plant_filters, plant_page_query, PLANT_PAGE_SORT, plant_page_skip, plant_facet_pipeline,
+    unpack_plant_facets, EXPORT_BATCH_SIZE, PLANT_EXPORT_FIELDS, CARE_EVENT_EXPORT_FIELDS,
+    PLANT_EXPORT_PROJECTION, export_query, plant_export_row, care_event_export_row, ExportEncoder,
+    gzip_compressor, export_headers, IMPORT_CHUNK_SIZE, IMPORT_FORMATS, import_format,
+    read_import_rows, new_import_summary, import_chunks, failed_import_plants, imported_events,
+    imported_event_documents, lost_imported_events, DUE_SOON_LIMIT, due_plants_query,
+    serialize_due_plant, parse_days_ahead, FORUM_VERSION_KEY, FORUM_REPLY_PAGE_SIZE,
+    FORUM_POST_PROJECTION, add_reply_update, parse_post_id, SEARCH_PAGE_SIZE, SEARCH_MAX_PAGES,
+    FORUM_SEARCH_PROJECTION, search_terms, parse_search_page, format_search_results, API_PREFIX,
+    PLANT_API_FIELDS, CARE_EVENT_API_FIELDS, FORUM_POST_API_FIELDS, ApiError, dump_json,
+    api_object_id, api_fields, api_ids, api_page_size, api_cursor, api_projection, api_document,
+    document_versions, api_etag, batch_payload
+)
 
 # --- App Setup ---
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default_fallback_key_for_dev')
 
+# --- Metrics ---
+# Created before the Mongo client so its command listener sees every query.
+# With METRICS_DIR set (gunicorn.conf.py does), /metrics reports the totals of
+# all worker processes instead of whichever one answered the scrape. The
+# endpoint is only served with METRICS_TOKEN set, to scrapers sending it.
+request_metrics = RequestMetrics(
+    app,
+    slow_threshold=float(os.getenv('SLOW_REQUEST_SECONDS', 0.5)),
+    shared_dir=os.getenv('METRICS_DIR') or None
+)
+
+@app.route('/metrics')
+def metrics():
+    token = os.getenv('METRICS_TOKEN')
+    if not token:
+        return 'Not Found', 404
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return 'Unauthorized', 401
+    return request_metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 # --- Database Setup ---
-mongo_uri = os.getenv('MONGO_URI')
-client = MongoClient(mongo_uri)
-db = client.plant_watering_db
+# The client is created on first use in each process, so importing the app (or
+# forking workers from a preloaded app) never shares a connection pool.
+# Pool size, timeouts and compression come from the MONGO_* settings.
+mongo = MongoConnection(app, event_listeners=[request_metrics.listener])
 
 # Collections
-plants_collection = db.plants
-users_collection = db.users
-care_events_collection = db.care_events
-forum_posts_collection = db.forum_posts  # <--- Collection for Forum
-
-# --- Image Definitions ---
-SPECIES_IMAGES = {
-    'Monstera': 'images/monstera.png',
-    'Pothos': 'images/pothos.png',
-    'Succulent': 'images/suculenta.png',
-    'Snake Plant': 'images/sansevieria.png',
-}
-DEFAULT_IMAGE = 'images/default.png'
+plants_collection = mongo.collection('plants')
+users_collection = mongo.collection('users')
+care_events_collection = mongo.collection('care_events')
+care_event_buckets_collection = mongo.collection('care_event_buckets')
+care_event_archive_collection = mongo.collection('care_event_archive')
+care_event_summaries_collection = mongo.collection('care_event_yearly_summaries')
+forum_posts_collection = mongo.collection('forum_posts')  # <--- Collection for Forum
+forum_replies_collection = mongo.collection('forum_replies')
+site_versions_collection = mongo.collection('site_versions')
+
+# --- Transactions ---
+# Multi-document writes run inside a transaction when the deployment supports it
+# (replica set / Atlas). A standalone mongod rejects transactions, in which case
+# the same writes run without one.
+transactions_enabled = os.getenv('MONGO_TRANSACTIONS', '1') == '1'
+
+def run_in_transaction(callback):
+    """Calls callback(session) inside a transaction and returns its result."""
+    global transactions_enabled
+    if transactions_enabled:
+        try:
+            with mongo.client.start_session() as session:
+                return session.with_transaction(callback)
+        except OperationFailure as e:
+            if e.code != 20:  # IllegalOperation: not a replica set member or mongos
+                raise
+            transactions_enabled = False
+    return callback(None)
+
+# --- Indexes ---
+# Every hot query filters/sorts on these keys, so they must exist before the
+# app serves traffic. create_index is idempotent, so running it on every start is safe.
+def index_specs():
+    """(collection, keys, options) for every index the app relies on."""
+    return [
+        # Dashboard sort and the API's (created_at, _id) keyset pages
+        (plants_collection, [('user_id', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+         {'name': 'user_created_at_id'}),
+        (care_events_collection,
+         [('plant_id', ASCENDING), ('user_id', ASCENDING), ('event_date', DESCENDING), ('_id', DESCENDING)],
+         {'name': 'plant_user_event_date_id'}),
+        (plants_collection, [('user_id', ASCENDING), ('next_due', ASCENDING)], {'name': 'user_next_due'}),
+        (plants_collection, [('user_id', ASCENDING), ('name_lower', ASCENDING)], {'name': 'user_name_lower'}),
+        (plants_collection, [('user_id', ASCENDING), ('last_watered', DESCENDING)],
+         {'name': 'user_last_watered'}),
+        # Global sweep for reminders across all users
+        (plants_collection, [('next_due', ASCENDING)], {'name': 'next_due'}),
+        (care_event_buckets_collection,
+         [('plant_id', ASCENDING), ('user_id', ASCENDING), ('month', DESCENDING)],
+         {'name': 'plant_user_month'}),
+        # Archive sweeps look for the oldest hot events across all plants
+        (care_events_collection, [('event_date', ASCENDING)], {'name': 'event_date'}),
+        (care_event_buckets_collection, [('month', ASCENDING)], {'name': 'month'}),
+        (care_event_archive_collection,
+         [('plant_id', ASCENDING), ('user_id', ASCENDING), ('event_date', DESCENDING), ('_id', DESCENDING)],
+         {'name': 'plant_user_event_date_id'}),
+        (care_event_summaries_collection,
+         [('plant_id', ASCENDING), ('user_id', ASCENDING), ('year', DESCENDING)],
+         {'unique': True, 'name': 'plant_user_year'}),
+        (users_collection, [('email', ASCENDING)], {'unique': True, 'name': 'email_unique'}),
+        (forum_posts_collection, [('created_at', DESCENDING), ('_id', DESCENDING)], {'name': 'created_at_id'}),
+        (forum_posts_collection, [('title', TEXT), ('content', TEXT)],
+         {'weights': {'title': 5, 'content': 1}, 'name': 'title_content_text'}),
+        (forum_replies_collection,
+         [('post_id', ASCENDING), ('created_at', ASCENDING), ('_id', ASCENDING)],
+         {'name': 'post_created_at_id'}),
+    ]
+
+# Indexes replaced by a wider one in index_specs(): (collection, old name, new name).
+# The old one is dropped once its replacement exists, so writes stop maintaining both.
+def obsolete_indexes():
+    return [
+        (plants_collection, 'user_created_at', 'user_created_at_id'),
+        (care_events_collection, 'plant_user_event_date', 'plant_user_event_date_id'),
+        (forum_posts_collection, 'created_at', 'created_at_id'),
+    ]
+
+def drop_obsolete_indexes(failed):
+    for collection, name, replacement in obsolete_indexes():
+        if f"{collection.name}.{replacement}" in failed:
+            continue
+        try:
+            collection.drop_index(name)
+        except OperationFailure:
+            pass  # already gone
+        except PyMongoError as e:
+            print(f"Error dropping index {collection.name}.{name}: {e}")
+
+def ensure_indexes():
+    """
+    Creates every index, each on its own: one that fails (say, the unique
+    email index over existing duplicates) is logged and the rest are still
+    created. Returns the names of the indexes that failed.
+    """
+    failed = []
+    specs = index_specs()
+    for position, (collection, keys, options) in enumerate(specs):
+        try:
+            collection.create_index(keys, **options)
+        except ConnectionFailure as e:
+            # The server is unreachable; the remaining indexes would only time out too
+            print(f"Error creating indexes: {e}")
+            return failed + [f"{c.name}.{o['name']}" for c, _, o in specs[position:]]
+        except PyMongoError as e:
+            print(f"Error creating index {collection.name}.{options['name']}: {e}")
+            failed.append(f"{collection.name}.{options['name']}")
+    drop_obsolete_indexes(failed)
+    return failed
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create the MongoDB indexes used by the app."""
+    failed = ensure_indexes()
+    if failed:
+        print(f"Could not create {len(failed)} indexes: {', '.join(failed)}")
+    else:
+        print('Indexes created.')
+
+if os.getenv('AUTO_CREATE_INDEXES', '1') == '1':
+    ensure_indexes()
+
+# --- Pagination Helpers ---
+def fetch_page(collection, query, field, cursor=None, page_size=20, projection=None,
+               direction=DESCENDING):
+    """Returns (documents, next_token) for one page sorted newest first (or oldest first)."""
+    if cursor:
+        query = {'$and': [query, keyset_filter(field, cursor, direction)]}
+    docs = list(collection.find(query, projection)
+                .sort([(field, direction), ('_id', direction)])
+                .limit(page_size + 1))
+    next_token = None
+    if len(docs) > page_size:
+        docs = docs[:page_size]
+        next_token = encode_cursor(docs[-1][field], docs[-1]['_id'])
+    return docs, next_token
+
+# --- Care Stats ---
+@app.cli.command('backfill-care-stats')
+def backfill_care_stats_command():
+    """One-off: compute care_stats for plants created before they existed."""
+    events = care_events_collection.find(
+        {'event_type': 'water'}, {'plant_id': 1, 'event_date': 1}
+    ).sort([('plant_id', ASCENDING), ('event_date', ASCENDING)])
+
+    updated = 0
+    current_plant, stats = None, None
+    for event in events:
+        if event['plant_id'] != current_plant:
+            if stats:
+                plants_collection.update_one({'_id': current_plant}, {'$set': {'care_stats': stats}, '$inc': VERSION_INC})
+                updated += 1
+            current_plant, stats = event['plant_id'], initial_care_stats(event['event_date'])
+            continue
+        gap = (event['event_date'] - stats['last_event']).total_seconds()
+        stats['total_waterings'] += 1
+        stats['last_event'] = event['event_date']
+        stats['longest_gap_seconds'] = max(stats['longest_gap_seconds'], gap)
+    if stats:
+        plants_collection.update_one({'_id': current_plant}, {'$set': {'care_stats': stats}, '$inc': VERSION_INC})
+        updated += 1
+    print(f'Updated care stats for {updated} plants.')
+
+# --- Care Event Storage ---
+def record_care_events(events, session=None, ordered=True):
+    """Writes care events using the configured storage layout."""
+    if CARE_EVENTS_STORAGE == 'buckets':
+        for event in events:
+            event.setdefault('_id', ObjectId())
+        care_event_buckets_collection.bulk_write(
+            [bucket_upsert(event) for event in events], ordered=True, session=session
+        )
+    elif len(events) == 1:
+        care_events_collection.insert_one(events[0], session=session)
+    else:
+        care_events_collection.insert_many(events, ordered=ordered, session=session)
+
+def delete_care_events(query, session=None):
+    """Deletes care events matching a plant_id/user_id query, archived ones included."""
+    if CARE_EVENTS_STORAGE == 'buckets':
+        care_event_buckets_collection.delete_many(query, session=session)
+    else:
+        care_events_collection.delete_many(query, session=session)
+    care_event_archive_collection.delete_many(query, session=session)
+    care_event_summaries_collection.delete_many(query, session=session)
+
+def fetch_care_history(plant_id, user_id, cursor=None, page_size=HISTORY_PAGE_SIZE):
+    """Returns (events, next_token) for one page of a plant's history, newest first."""
+    query = {'plant_id': plant_id, 'user_id': user_id}
+    if CARE_EVENTS_STORAGE != 'buckets':
+        return fetch_page(care_events_collection, query, 'event_date',
+                          cursor=cursor, page_size=page_size)
+
+    if cursor:
+        query['month'] = {'$lte': month_start(cursor[0])}
+    buckets = care_event_buckets_collection.find(
+        query, {'month': 1, 'events': 1}
+    ).sort('month', DESCENDING).batch_size(4)
+
+    # Events of different months never interleave, so buckets are read only
+    # until one month past the end of the page.
+    events = []
+    for _, month_buckets in groupby(buckets, key=lambda b: b['month']):
+        month_events = [event for bucket in month_buckets for event in bucket['events']]
+        month_events.sort(key=lambda e: (e['event_date'], e['_id']), reverse=True)
+        if cursor:
+            month_events = [e for e in month_events if (e['event_date'], e['_id']) < cursor]
+        events.extend(month_events)
+        if len(events) > page_size:
+            break
+
+    next_token = None
+    if len(events) > page_size:
+        events = events[:page_size]
+        next_token = encode_cursor(events[-1]['event_date'], events[-1]['_id'])
+    return events, next_token
+
+def iter_care_events(plant_id, user_id, batch_size=500):
+    """Yields every care event of a plant, oldest first, reading from a batched cursor."""
+    query = {'plant_id': plant_id, 'user_id': user_id}
+    # Archived events are all older than the hot ones, so they come first
+    yield from care_event_archive_collection.find(query).sort(
+        [('event_date', ASCENDING), ('_id', ASCENDING)]
+    ).batch_size(batch_size)
+    if CARE_EVENTS_STORAGE != 'buckets':
+        yield from care_events_collection.find(query).sort(
+            [('event_date', ASCENDING), ('_id', ASCENDING)]
+        ).batch_size(batch_size)
+        return
+
+    buckets = care_event_buckets_collection.find(
+        query, {'month': 1, 'events': 1}
+    ).sort('month', ASCENDING).batch_size(4)
+    # A month can span several buckets, so only one month is held in memory at a time
+    for _, month_buckets in groupby(buckets, key=lambda b: b['month']):
+        month_events = [event for bucket in month_buckets for event in bucket['events']]
+        month_events.sort(key=lambda e: (e['event_date'], e['_id']))
+        yield from month_events
+
+# --- Care Event Write-Behind ---
+# Optional (CARE_EVENT_WRITE_BEHIND=1): the care event of a single watering is
+# queued in process and written in batches by a background thread instead of
+# one insert per click. The plant document is still updated right away, and
+# pending events are merged into the plant's history until they are written.
+# Repeated clicks on the same plant within WATER_COALESCE_SECONDS are ignored.
+# The queue and the claims live in one worker process: with several workers a
+# repeated click served by another worker is not coalesced, and a history page
+# served by another worker leaves out the pending events until they are
+# written (CARE_EVENT_FLUSH_INTERVAL, 1s by default). Writing them bumps the
+# plants' versions again, so pages cached without them are re-rendered.
+CARE_EVENT_WRITE_BEHIND = os.getenv('CARE_EVENT_WRITE_BEHIND', '0') == '1'
+WATER_COALESCE_SECONDS = float(os.getenv('WATER_COALESCE_SECONDS', 10))
+
+def only_duplicate_keys(error):
+    """True if a BulkWriteError failed only on documents that already exist."""
+    return all(e.get('code') == 11000 for e in error.details.get('writeErrors', []))
+
+def flush_care_events(events):
+    try:
+        record_care_events(events, ordered=False)
+    except BulkWriteError as e:
+        # A retried batch may already be partly written; those inserts are duplicates
+        if not only_duplicate_keys(e):
+            raise
+    plant_ids = list({event['plant_id'] for event in events})
+    plants_collection.update_many({'_id': {'$in': plant_ids}}, {'$inc': VERSION_INC})
+
+care_event_buffer = None
+if CARE_EVENT_WRITE_BEHIND:
+    care_event_buffer = WriteBehindBuffer(
+        flush_care_events,
+        flush_size=int(os.getenv('CARE_EVENT_FLUSH_SIZE', 200)),
+        flush_interval=float(os.getenv('CARE_EVENT_FLUSH_INTERVAL', 1.0)),
+        capacity=int(os.getenv('CARE_EVENT_QUEUE_LIMIT', 10000)),
+        coalesce_window=WATER_COALESCE_SECONDS
+    )
+    atexit.register(care_event_buffer.close)
+
+def pending_care_events(plant_id, user_id):
+    if care_event_buffer is None:
+        return []
+    return care_event_buffer.pending(
+        lambda event: event['plant_id'] == plant_id and event['user_id'] == user_id
+    )
+
+def with_pending_care_events(events, plant_id, user_id):
+    """Puts still-queued events in front of the first page of a plant's history."""
+    # Queued waterings are newer than anything saved
+    saved_ids = {event['_id'] for event in events}
+    pending = [event for event in pending_care_events(plant_id, user_id)
+               if event['_id'] not in saved_ids]
+    return sorted(pending, key=lambda e: e['event_date'], reverse=True) + events
+
+def discard_pending_care_events(plant_ids, user_id):
+    """Drops queued events of plants that are being deleted, so they are never written."""
+    if care_event_buffer is not None:
+        care_event_buffer.discard(
+            lambda event: event['plant_id'] in plant_ids and event['user_id'] == user_id
+        )
+
+@app.cli.command('migrate-care-events')
+@click.option('--delete-source', is_flag=True, help='Delete care_events documents once migrated.')
+@click.option('--force', is_flag=True, help='Run even if care_event_buckets is not empty.')
+def migrate_care_events_command(delete_source, force):
+    """Converts per-event care_events documents into monthly buckets."""
+    if not force and care_event_buckets_collection.estimated_document_count() > 0:
+        print('care_event_buckets already has data; use --force to migrate anyway.')
+        return
+
+    events = care_events_collection.find().sort(
+        [('plant_id', ASCENDING), ('event_date', ASCENDING)]
+    ).batch_size(1000)
+
+    migrated = 0
+    batch = []
+
+    def flush(batch):
+        care_event_buckets_collection.bulk_write([bucket_upsert(e) for e in batch], ordered=True)
+        if delete_source:
+            care_events_collection.delete_many({'_id': {'$in': [e['_id'] for e in batch]}})
+        return len(batch)
+
+    for event in events:
+        batch.append(event)
+        if len(batch) >= 1000:
+            migrated += flush(batch)
+            batch = []
+    if batch:
+        migrated += flush(batch)
+
+    print(f'Migrated {migrated} care events into buckets.')
+    print('Set CARE_EVENTS_STORAGE=buckets to start using them.')
+
+# --- Care Event Archive ---
+# Events older than CARE_EVENT_HOT_DAYS are moved out of the hot collections by
+# `flask archive-care-events` (meant to run from cron): raw events go to
+# care_event_archive and per-plant yearly totals to care_event_yearly_summaries.
+# The plant page only reads the hot tier; the archive has its own page. Every
+# archived event bumps its plant's version, so cached plant pages revalidate.
+CARE_EVENT_HOT_DAYS = int(os.getenv('CARE_EVENT_HOT_DAYS', 365))
+ARCHIVE_BATCH_SIZE = 1000
+
+def next_archive_batch(cutoff, batch_size):
+    """Returns (source collection, source _ids, events) for the oldest hot events before cutoff."""
+    if CARE_EVENTS_STORAGE != 'buckets':
+        events = list(care_events_collection.find({'event_date': {'$lt': cutoff}})
+                      .sort('event_date', ASCENDING).limit(batch_size))
+        return care_events_collection, [event['_id'] for event in events], events
+
+    # Buckets move whole, so only months that ended before the cutoff are archived
+    buckets = care_event_buckets_collection.find(
+        {'month': {'$lt': month_start(cutoff)}}
+    ).sort('month', ASCENDING).batch_size(50)
+    bucket_ids, events = [], []
+    for bucket in buckets:
+        bucket_ids.append(bucket['_id'])
+        events.extend(dict(event, plant_id=bucket['plant_id'], user_id=bucket['user_id'])
+                      for event in bucket['events'])
+        if len(events) >= batch_size:
+            break
+    buckets.close()
+    return care_event_buckets_collection, bucket_ids, events
+
+def yearly_summary_updates(events):
+    """One upsert per plant and year adding the batch to that year's totals."""
+    summaries = {}
+    for event in events:
+        key = (event['plant_id'], event['user_id'], event['event_date'].year)
+        summary = summaries.setdefault(key, {
+            'count': 0, 'first': event['event_date'], 'last': event['event_date'], 'types': {}
+        })
+        summary['count'] += 1
+        summary['first'] = min(summary['first'], event['event_date'])
+        summary['last'] = max(summary['last'], event['event_date'])
+        event_type = event.get('event_type', 'water')
+        summary['types'][event_type] = summary['types'].get(event_type, 0) + 1
+
+    return [UpdateOne(
+        {'plant_id': plant_id, 'user_id': user_id, 'year': year},
+        {
+            '$inc': {'count': summary['count'],
+                     **{f'by_type.{t}': n for t, n in summary['types'].items()}},
+            '$min': {'first_event': summary['first']},
+            '$max': {'last_event': summary['last']}
+        },
+        upsert=True
+    ) for (plant_id, user_id, year), summary in summaries.items()]
+
+def archived_count_updates(events):
+    """
+    Keeps plants.archived_events in step, so the plant page knows an archive
+    exists, and bumps the version so its cached pages are re-rendered.
+    """
+    counts = {}
+    for event in events:
+        counts[event['plant_id']] = counts.get(event['plant_id'], 0) + 1
+    return [UpdateOne({'_id': plant_id}, {'$inc': {'archived_events': n, **VERSION_INC}})
+            for plant_id, n in counts.items()]
+
+def archive_care_events(cutoff, batch_size=ARCHIVE_BATCH_SIZE, max_batches=None, pause=0):
+    """
+    Moves care events older than cutoff into the archive, one batch per
+    transaction, oldest first. Returns the number of events moved. Without
+    transactions, a batch interrupted halfway is finished by the next run, but
+    its yearly totals may then be counted twice.
+    """
+    archived = batches = 0
+    while max_batches is None or batches < max_batches:
+        source, source_ids, events = next_archive_batch(cutoff, batch_size)
+        if not events:
+            break
+
+        def move(session):
+            try:
+                care_event_archive_collection.insert_many(events, ordered=False, session=session)
+            except BulkWriteError as e:
+                if not only_duplicate_keys(e):
+                    raise
+            care_event_summaries_collection.bulk_write(
+                yearly_summary_updates(events), ordered=False, session=session
+            )
+            plants_collection.bulk_write(archived_count_updates(events), ordered=False, session=session)
+            source.delete_many({'_id': {'$in': source_ids}}, session=session)
+
+        run_in_transaction(move)
+        archived += len(events)
+        batches += 1
+        if pause:
+            time.sleep(pause)  # leaves room for live traffic between batches
+    return archived
+
+@app.cli.command('archive-care-events')
+@click.option('--days', type=int, default=CARE_EVENT_HOT_DAYS, show_default=True,
+              help='Keep events from the last DAYS days in the hot tier.')
+@click.option('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE, show_default=True)
+@click.option('--max-batches', type=int, help='Stop after this many batches.')
+@click.option('--pause', type=float, default=0.0, help='Seconds to wait between batches.')
+def archive_care_events_command(days, batch_size, max_batches, pause):
+    """Moves old care events into the archive tier, in batches."""
+    cutoff = datetime.now() - timedelta(days=days)
+    archived = archive_care_events(cutoff, batch_size=batch_size, max_batches=max_batches, pause=pause)
+    print(f'Archived {archived} care events from before {cutoff:%Y-%m-%d}.')
+
+# --- Image Derivatives ---
+image_manifest = startup_image_manifest(app.static_folder)
+
+def build_image_derivatives():
+    global image_manifest
+    image_manifest = build_image_manifest(app.static_folder)
+    return image_manifest
+
+@app.cli.command('build-images')
+def build_images_command():
+    """Generate resized, content-hashed copies of the plant images."""
+    manifest = build_image_derivatives()
+    print(f'Built derivatives for {len(manifest)} images.')
+
+@app.template_global()
+def image_variants(image_url):
+    """Returns the <source> srcsets and fallback <img> data for a static image, or None."""
+    return picture_sources(image_manifest, image_url, lambda path: url_for('static', filename=path))
+
+# --- Static Assets ---
+# Every static file is copied to static/assets under a content-hashed name, with
+# brotli/gzip variants of the text files, and url_for('static', ...) points at
+# the hashed copy. Those are served in the best encoding the client accepts.
+asset_manifest = startup_asset_manifest(app.static_folder)
+asset_encodings = encodings_by_path(asset_manifest)
+
+def build_static_assets():
+    global asset_manifest, asset_encodings
+    asset_manifest = build_assets(app.static_folder)
+    asset_encodings = encodings_by_path(asset_manifest)
+    return asset_manifest
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress the static files."""
+    manifest = build_static_assets()
+    print(f'Fingerprinted {len(manifest)} static files.')
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    # Debug runs keep the plain names so edits to static files show up without a rebuild
+    if endpoint == 'static' and asset_manifest and not app.debug:
+        values['filename'] = fingerprinted_path(asset_manifest, values.get('filename'))
+
+def send_static_asset(filename):
+    path, encoding = precompressed_variant(asset_encodings, filename, request.accept_encodings)
+    response = app.send_static_file(path)
+    if filename in asset_encodings:
+        response.vary.add('Accept-Encoding')
+    if encoding:
+        response.content_encoding = encoding
+        response.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    return response
+
+app.view_functions['static'] = send_static_asset
+
+@app.after_request
+def cache_fingerprinted_files(response):
+    # Derivative and asset filenames change whenever their content does, so they never need revalidating
+    fingerprinted_dirs = (f"{app.static_url_path}/{DERIVED_DIR}/", f"{app.static_url_path}/{ASSETS_DIR}/")
+    if request.path.startswith(fingerprinted_dirs) and response.status_code == 200:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMAGE_CACHE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+# --- Password Hashing ---
+def run_hash_job(fn, *args):
+    """
+    Runs fn(*args) on the hashing pool. A pool whose process died stays broken,
+    so it is replaced and the job retried once before giving up with a 503.
+    """
+    for _ in range(2):
+        executor = get_hash_executor()
+        try:
+            return submit_hash_job(executor, fn, *args).result(timeout=HASH_TIMEOUT)
+        except FutureTimeoutError:
+            raise HashingOverloaded()
+        except BrokenProcessPool as e:
+            print(f"Password hashing pool broke, replacing it: {e}")
+            discard_hash_executor(executor)
+    raise HashingOverloaded()
+
+def hash_password(password):
+    return run_hash_job(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def verify_password(password_hash, password):
+    return run_hash_job(check_password_hash, password_hash, password)
+
+@app.errorhandler(HashingOverloaded)
+def hashing_overloaded(e):
+    flash('Too many sign-in requests right now. Please try again in a moment.', 'error')
+    template = HASHING_FORM_TEMPLATES.get(request.endpoint, 'login.html')
+    response = app.make_response((render_template(template), 503))
+    response.headers['Retry-After'] = '5'
+    return response
 
 # --- Flask-Login Setup ---
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-class User(UserMixin):
-    def __init__(self, user_data):
-        self.id = str(user_data['_id'])
-        self.username = user_data['username']
-        self.email = user_data['email']
-        self.password_hash = user_data['password_hash']
-
-    @staticmethod
-    def get(user_id):
-        user_data = users_collection.find_one({'_id': ObjectId(user_id)})
-        if user_data:
-            return User(user_data)
-        return None
+user_cache = UserCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('USER_CACHE_TTL', 60))
+)
+
+def find_user(user_id):
+    user_data = users_collection.find_one({'_id': ObjectId(user_id)})
+    if user_data:
+        return User(user_data)
+    return None
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.get(user_id)
+    user = user_cache.get(user_id)
+    if user is None:
+        user = find_user(user_id)
+        if user:
+            user_cache.put(user)
+    return user
+
+# --- Page Cache ---
+# Rendered forum and plant detail pages are cached per user and URL. Each page
+# has a validator read from MongoDB (the plant's version, the forum's version
+# counter), so every worker agrees on it: responses carry an ETag built from
+# it, unchanged pages come back as 304 without rendering, and a write anywhere
+# changes the validator without any invalidation step.
+page_cache = PageCache(
+    app.config['SECRET_KEY'],
+    LRUBackend(maxsize=int(os.getenv('PAGE_CACHE_SIZE', 512)),
+               ttl=float(os.getenv('PAGE_CACHE_TTL', 300)))
+)
+
+def plant_namespace(plant_id):
+    return f"plant:{plant_id}"
+
+def plant_page_validator(plant_id):
+    """(namespace, validator) for a plant's pages, or None if the user has no such plant."""
+    if not ObjectId.is_valid(plant_id):
+        return None
+    plant = plants_collection.find_one(
+        {'_id': ObjectId(plant_id), 'user_id': ObjectId(current_user.id)}, {'version': 1}
+    )
+    return plant and (plant_namespace(plant_id), plant.get('version', 0))
+
+def cached_page(validator_for):
+    """
+    Caches a view that returns rendered HTML. validator_for(**url_args) returns
+    (namespace, validator), or None to render without the cache.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            # Pending flash messages are rendered into the page, so it cannot be reused
+            if session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            validated = validator_for(**kwargs)
+            if validated is None:
+                return view(*args, **kwargs)  # the view reports the missing document
+
+            namespace, validator = validated
+            variant = f"{current_user.get_id() or 'anonymous'}:{request.full_path}"
+            etag = page_cache.etag(namespace, validator, variant)
+
+            if request.if_none_match.contains(etag):
+                response = app.response_class(status=304)
+            else:
+                body = page_cache.get(namespace, validator, variant)
+                if body is None:
+                    body = view(*args, **kwargs)
+                    if not isinstance(body, str):
+                        return body  # redirects are never cached
+                    page_cache.set(namespace, validator, variant, body)
+                response = app.make_response(body)
+
+            response.set_etag(etag)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+        return wrapped
+    return decorator
 
 # --- Auth Routes ---
 @app.route('/register', methods=['GET', 'POST'])
@@ -70,15 +718,21 @@ def register():
             flash('Email already registered. Please log in.', 'error')
             return redirect(url_for('login'))
 
-        password_hash = generate_password_hash(password)
-        new_user_id = users_collection.insert_one({
+        password_hash = hash_password(password)
+        user_data = {
             'username': username,
             'email': email,
             'password_hash': password_hash
-        }).inserted_id
+        }
+        try:
+            user_data['_id'] = users_collection.insert_one(user_data).inserted_id
+        except DuplicateKeyError:
+            # Lost a race with a concurrent registration for the same email
+            flash('Email already registered. Please log in.', 'error')
+            return redirect(url_for('login'))
 
-        user_data = users_collection.find_one({'_id': new_user_id})
         new_user = User(user_data)
+        user_cache.put(new_user)
         login_user(new_user)
         
         return redirect(url_for('index'))
@@ -93,8 +747,17 @@ def login():
 
         user_data = users_collection.find_one({'email': email})
 
-        if user_data and check_password_hash(user_data['password_hash'], password):
+        if user_data and verify_password(user_data['password_hash'], password):
+            if needs_rehash(user_data['password_hash']):
+                # Transparently move the account to the current work factor
+                user_data['password_hash'] = hash_password(password)
+                users_collection.update_one(
+                    {'_id': user_data['_id']},
+                    {'$set': {'password_hash': user_data['password_hash']}}
+                )
+                user_cache.invalidate(user_data['_id'])
             user = User(user_data)
+            user_cache.put(user)
             login_user(user)
             return redirect(url_for('index'))
         else:
@@ -105,19 +768,34 @@ def login():
 @app.route('/logout')
 @login_required
 def logout():
+    user_cache.invalidate(current_user.id)
     logout_user()
     return redirect(url_for('index'))
 
 # --- Main App Routes ---
 
+@app.cli.command('backfill-name-lower')
+def backfill_name_lower_command():
+    """One-off: add the lowercase name used by the dashboard name search."""
+    result = plants_collection.update_many(
+        {'name_lower': {'$exists': False}},
+        [{'$set': {'name_lower': {'$toLower': '$name'}}}]
+    )
+    print(f'Updated {result.modified_count} plants.')
+
 @app.route('/')
 def index():
-    plants = []
+    filters = parse_plant_filters(request.args)
+    plants, result = [], []
     if current_user.is_authenticated:
-        user_plants = plants_collection.find({'user_id': ObjectId(current_user.id)})
-        plants = sorted(user_plants, key=lambda p: p.get('created_at', datetime.min), reverse=True)
-        
-    return render_template('index.html', plants=plants)
+        owner_id = ObjectId(current_user.id)
+        plants = list(plants_collection.find(plant_page_query(owner_id, filters))
+                      .sort(PLANT_PAGE_SORT)
+                      .skip(plant_page_skip(filters))
+                      .limit(PLANTS_PAGE_SIZE))
+        result = list(plants_collection.aggregate(plant_facet_pipeline(owner_id, filters)))
+
+    return render_template('index.html', **unpack_plant_facets(result, plants, filters))
 
 @app.route('/add', methods=['GET', 'POST'])
 @login_required
@@ -134,21 +812,25 @@ def add_plant():
 
         plant_document = {
             'name': plant_name,
+            'name_lower': plant_name.lower(),
             'species': plant_species,
             'last_watered': last_watered_date,
             'image_url': plant_image_url,
             'created_at': datetime.now(),
-            'user_id': ObjectId(current_user.id)
+            'user_id': ObjectId(current_user.id),
+            'care_stats': initial_care_stats(last_watered_date),
+            'watering_interval_days': watering_interval(plant_species),
+            'next_due': next_due_date(last_watered_date, plant_species)
         }
         new_plant_id = plants_collection.insert_one(plant_document).inserted_id
 
-        care_events_collection.insert_one({
+        record_care_events([{
             'plant_id': new_plant_id,
             'user_id': ObjectId(current_user.id),
             'event_type': 'water',
             'event_date': last_watered_date,
             'notes': 'Initial watering specified on creation.'
-        })
+        }])
 
         return redirect(url_for('index'))
 
@@ -158,15 +840,7 @@ def add_plant():
 @login_required
 def edit_plant(plant_id):
     plant_id_obj = ObjectId(plant_id)
-    plant_to_edit = plants_collection.find_one({
-        '_id': plant_id_obj,
-        'user_id': ObjectId(current_user.id)
-    })
-
-    if not plant_to_edit:
-        flash('Plant not found or you do not have permission.', 'error')
-        return redirect(url_for('index'))
-
+    owner_filter = {'_id': plant_id_obj, 'user_id': ObjectId(current_user.id)}
     available_species = list(SPECIES_IMAGES.keys())
 
     if request.method == 'POST':
@@ -179,18 +853,31 @@ def edit_plant(plant_id):
         update_data = {
             '$set': {
                 'name': updated_name,
+                'name_lower': updated_name.lower(),
                 'species': updated_species,
                 'last_watered': updated_last_watered,
-                'image_url': updated_image_url
-            }
+                'image_url': updated_image_url,
+                'watering_interval_days': watering_interval(updated_species),
+                'next_due': next_due_date(updated_last_watered, updated_species)
+            },
+            '$inc': VERSION_INC
         }
-        plants_collection.update_one({'_id': plant_id_obj}, update_data)
+        # The ownership check is part of the update filter, so there is no separate read
+        result = plants_collection.update_one(owner_filter, update_data)
+        if result.matched_count == 0:
+            flash('Plant not found or you do not have permission.', 'error')
+        return redirect(url_for('index'))
+
+    plant_to_edit = plants_collection.find_one(owner_filter)
+    if not plant_to_edit:
+        flash('Plant not found or you do not have permission.', 'error')
         return redirect(url_for('index'))
-    else:
-        return render_template('edit_plant.html', plant=plant_to_edit, species_list=available_species)
+
+    return render_template('edit_plant.html', plant=plant_to_edit, species_list=available_species)
 
 @app.route('/plant/<string:plant_id>')
 @login_required
+@cached_page(plant_page_validator)
 def plant_detail(plant_id):
     plant_id_obj = ObjectId(plant_id)
     plant = plants_collection.find_one({
@@ -202,37 +889,105 @@ def plant_detail(plant_id):
         flash('Plant not found or you do not have permission.', 'error')
         return redirect(url_for('index'))
 
-    events_cursor = care_events_collection.find({
-        'plant_id': plant_id_obj,
-        'user_id': ObjectId(current_user.id)
-    })
-    
-    events = sorted(events_cursor, key=lambda e: e.get('event_date', datetime.min), reverse=True)
-    return render_template('plant_detail.html', plant=plant, events=events)
+    cursor = None
+    token = request.args.get('before')
+    if token:
+        try:
+            cursor = decode_cursor(token)
+        except ValueError:
+            flash('Invalid page link.', 'error')
+            return redirect(url_for('plant_detail', plant_id=plant_id))
+
+    events, next_token = fetch_care_history(
+        plant_id_obj, ObjectId(current_user.id), cursor=cursor
+    )
+    if cursor is None:
+        events = with_pending_care_events(events, plant_id_obj, ObjectId(current_user.id))
+
+    return render_template('plant_detail.html', plant=plant, events=events,
+                           stats=care_stats_summary(plant), next_token=next_token,
+                           is_first_page=cursor is None)
+
+@app.route('/plant/<string:plant_id>/archive')
+@login_required
+@cached_page(plant_page_validator)
+def plant_archive(plant_id):
+    """Archived history of a plant: yearly totals and the raw events, newest first."""
+    plant_id_obj = ObjectId(plant_id)
+    owner_id = ObjectId(current_user.id)
+    plant = plants_collection.find_one({'_id': plant_id_obj, 'user_id': owner_id},
+                                       {'name': 1, 'archived_events': 1})
+
+    if not plant:
+        flash('Plant not found or you do not have permission.', 'error')
+        return redirect(url_for('index'))
+
+    cursor = None
+    token = request.args.get('before')
+    if token:
+        try:
+            cursor = decode_cursor(token)
+        except ValueError:
+            flash('Invalid page link.', 'error')
+            return redirect(url_for('plant_archive', plant_id=plant_id))
+
+    query = {'plant_id': plant_id_obj, 'user_id': owner_id}
+    summaries = []
+    if cursor is None:
+        summaries = list(care_event_summaries_collection.find(query).sort('year', DESCENDING))
+    events, next_token = fetch_page(care_event_archive_collection, query, 'event_date',
+                                    cursor=cursor, page_size=HISTORY_PAGE_SIZE)
+    return render_template('plant_archive.html', plant=plant, summaries=summaries,
+                           events=events, next_token=next_token, is_first_page=cursor is None)
 
 @app.route('/water/<string:plant_id>', methods=['POST'])
 @login_required
 def water_plant(plant_id):
     plant_id_obj = ObjectId(plant_id)
+    owner_id = ObjectId(current_user.id)
     now = datetime.now()
 
-    plant_to_update = plants_collection.find_one({
-        '_id': plant_id_obj,
-        'user_id': ObjectId(current_user.id)
-    })
+    claim = (owner_id, plant_id_obj)
+    if care_event_buffer is not None and not care_event_buffer.claim(claim):
+        # A repeated click; the first one already watered the plant
+        return redirect(url_for('index'))
+
+    event = {
+        '_id': ObjectId(),
+        'plant_id': plant_id_obj,
+        'user_id': owner_id,
+        'event_type': 'water',
+        'event_date': now
+    }
 
-    if plant_to_update:
-        plants_collection.update_one(
-            {'_id': plant_id_obj},
-            {'$set': {'last_watered': now}}
+    def water(session):
+        # Only matches if the plant belongs to the user; the event is written in the same transaction
+        result = plants_collection.update_one(
+            {'_id': plant_id_obj, 'user_id': owner_id},
+            care_stats_update(now),
+            session=session
         )
-        care_events_collection.insert_one({
-            'plant_id': plant_id_obj,
-            'user_id': ObjectId(current_user.id),
-            'event_type': 'water',
-            'event_date': now
-        })
+        if result.matched_count == 0:
+            return False
+        if care_event_buffer is None:
+            record_care_events([event], session=session)
+        return True
+
+    try:
+        watered = run_in_transaction(water)
+    except Exception:
+        # Nothing was watered, so the next click must not be ignored
+        if care_event_buffer is not None:
+            care_event_buffer.release(claim)
+        raise
+
+    if watered:
+        # Queued only once the update has committed; a full queue falls back to a direct insert
+        if care_event_buffer is not None and not care_event_buffer.add(event):
+            flush_care_events([event])
     else:
+        if care_event_buffer is not None:
+            care_event_buffer.release(claim)
         flash('Plant not found or you do not have permission.', 'error')
     
     return redirect(url_for('index'))
@@ -241,15 +996,23 @@ def water_plant(plant_id):
 @login_required
 def delete_plant(plant_id):
     plant_id_obj = ObjectId(plant_id)
-    plant_to_delete = plants_collection.find_one({
-        '_id': plant_id_obj,
-        'user_id': ObjectId(current_user.id)
-    })
-    
-    if plant_to_delete:
-        plants_collection.delete_one({'_id': plant_id_obj})
-        care_events_collection.delete_many({'plant_id': plant_id_obj})
-    else:
+    owner_id = ObjectId(current_user.id)
+    discard_pending_care_events([plant_id_obj], owner_id)
+
+    def delete(session):
+        result = plants_collection.delete_one(
+            {'_id': plant_id_obj, 'user_id': owner_id},
+            session=session
+        )
+        if result.deleted_count == 0:
+            return False
+        delete_care_events(
+            {'plant_id': plant_id_obj, 'user_id': owner_id},
+            session=session
+        )
+        return True
+
+    if not run_in_transaction(delete):
         flash('Plant not found or you do not have permission.', 'error')
 
     return redirect(url_for('index'))
@@ -258,43 +1021,373 @@ def delete_plant(plant_id):
 @login_required
 def delete_selected_plants():
     # Get list of selected plant IDs from the checkboxes
-    plant_ids = request.form.getlist('plant_ids')
+    plant_ids = parse_object_ids(request.form.getlist('plant_ids'))
     
     if not plant_ids:
         flash('No plants selected for deletion.', 'warning')
         return redirect(url_for('index'))
 
-    deleted_count = 0
-    for plant_id in plant_ids:
-        try:
-            plant_id_obj = ObjectId(plant_id)
-            
-            # Security check: Ensure the plant belongs to the current user before deleting
-            result = plants_collection.delete_one({
-                '_id': plant_id_obj,
-                'user_id': ObjectId(current_user.id)
-            })
-            
-            if result.deleted_count > 0:
-                # Also delete associated care events
-                care_events_collection.delete_many({'plant_id': plant_id_obj})
-                deleted_count += 1
-                
-        except Exception as e:
-            print(f"Error deleting plant {plant_id}: {e}")
-            continue
-    
+    owner_id = ObjectId(current_user.id)
+    discard_pending_care_events(plant_ids, owner_id)
+
+    def delete_plants(session):
+        # Security check: the user_id filter only matches plants (and events) the user owns
+        result = plants_collection.delete_many(
+            {'_id': {'$in': plant_ids}, 'user_id': owner_id},
+            session=session
+        )
+        delete_care_events(
+            {'plant_id': {'$in': plant_ids}, 'user_id': owner_id},
+            session=session
+        )
+        return result.deleted_count
+
+    deleted_count = run_in_transaction(delete_plants)
     flash(f'Successfully deleted {deleted_count} selected plants.', 'info')
     return redirect(url_for('index'))
 
+@app.route('/water_selected_plants', methods=['POST'])
+@login_required
+def water_selected_plants():
+    plant_ids = parse_object_ids(request.form.getlist('plant_ids'))
+
+    if not plant_ids:
+        flash('No plants selected for watering.', 'warning')
+        return redirect(url_for('index'))
+
+    owner_id = ObjectId(current_user.id)
+    now = datetime.now()
+
+    def water_plants(session):
+        owned_ids = [plant['_id'] for plant in plants_collection.find(
+            {'_id': {'$in': plant_ids}, 'user_id': owner_id},
+            {'_id': 1},
+            session=session
+        )]
+        if not owned_ids:
+            return 0
+
+        plants_collection.update_many(
+            {'_id': {'$in': owned_ids}},
+            care_stats_update(now),
+            session=session
+        )
+        record_care_events([{
+            'plant_id': plant_id,
+            'user_id': owner_id,
+            'event_type': 'water',
+            'event_date': now
+        } for plant_id in owned_ids], session=session)
+        return len(owned_ids)
+
+    watered_count = run_in_transaction(water_plants)
+    flash(f'Watered {watered_count} selected plants.', 'info')
+    return redirect(url_for('index'))
+
+# --- Export ---
+# Exports are streamed: rows come from batched cursors and are written out in
+# chunks of about EXPORT_CHUNK_SIZE characters, so memory use does not grow with
+# the size of the history. Clients that accept gzip get it compressed on the fly.
+def plant_export_rows(owner_id, plant_id=None):
+    plants = plants_collection.find(
+        export_query(owner_id, plant_id), PLANT_EXPORT_PROJECTION
+    ).sort('created_at', ASCENDING).batch_size(EXPORT_BATCH_SIZE)
+    for plant in plants:
+        yield plant_export_row(plant)
+
+def care_event_export_rows(owner_id, plant_id=None):
+    plants = plants_collection.find(export_query(owner_id, plant_id), {'name': 1}).sort('created_at', ASCENDING)
+    # One indexed, batched query per plant keeps the events grouped and in date order
+    for plant in plants:
+        for event in iter_care_events(plant['_id'], owner_id, batch_size=EXPORT_BATCH_SIZE):
+            yield care_event_export_row(plant, event)
+
+EXPORT_DATASETS = {
+    'plants': (plant_export_rows, PLANT_EXPORT_FIELDS),
+    'care-history': (care_event_export_rows, CARE_EVENT_EXPORT_FIELDS),
+}
+
+def encode_export(rows, fmt, fields):
+    """Yields the rows as CSV or NDJSON text, a chunk at a time."""
+    encoder = ExportEncoder(fmt, fields)
+    for row in rows:
+        chunk = encoder.write(row)
+        if chunk:
+            yield chunk
+    chunk = encoder.take()
+    if chunk:
+        yield chunk
+
+def gzip_stream(chunks):
+    compressor = gzip_compressor()
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route('/export/<any(plants, "care-history"):dataset>.<any(csv, ndjson):fmt>')
+@login_required
+def export_data(dataset, fmt):
+    plant_id = None
+    if request.args.get('plant'):
+        plant_ids = parse_object_ids([request.args['plant']])
+        if not plant_ids:
+            flash('Invalid plant ID.', 'error')
+            return redirect(url_for('index'))
+        plant_id = plant_ids[0]
+
+    row_source, fields = EXPORT_DATASETS[dataset]
+    body = encode_export(row_source(ObjectId(current_user.id), plant_id), fmt, fields)
+    gzip = bool(request.accept_encodings['gzip'])
+    if gzip:
+        body = gzip_stream(body)
+    else:
+        body = (chunk.encode('utf-8') for chunk in body)
+
+    return Response(stream_with_context(body), headers=export_headers(dataset, fmt, gzip))
+
+# --- Bulk Import ---
+def import_plants(rows, owner_id, chunk_size=IMPORT_CHUNK_SIZE):
+    """Imports (line_number, row) pairs for owner_id and returns a summary with per-row errors."""
+    summary = new_import_summary()
+    events_collection = (care_event_buckets_collection if CARE_EVENTS_STORAGE == 'buckets'
+                         else care_events_collection)
+    for chunk in import_chunks(rows, owner_id, summary, chunk_size):
+        failed = set()
+        try:
+            plants_collection.insert_many([plant for _, plant, _ in chunk], ordered=False)
+        except BulkWriteError as e:
+            failed = failed_import_plants(summary, chunk, e)
+
+        events = imported_events(chunk, failed)
+        saved_events = len(events)
+        if events:
+            documents = imported_event_documents(events)
+            try:
+                events_collection.insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                saved_events -= lost_imported_events(summary, chunk, documents, e)
+
+        summary['plants'] += len(chunk) - len(failed)
+        summary['events'] += saved_events
+    return summary
+
+@app.route('/import', methods=['GET', 'POST'])
+@login_required
+def import_plants_view():
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Choose a CSV or NDJSON file to import.', 'error')
+            return redirect(url_for('import_plants_view'))
+
+        fmt = import_format(upload.filename, request.form.get('format', 'csv'))
+        # Uploads are spooled to disk by Werkzeug and decoded here as they are read
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        summary = import_plants(read_import_rows(stream, fmt), ObjectId(current_user.id))
+        flash(f"Imported {summary['plants']} plants and {summary['events']} care events.",
+              'info' if not summary['error_count'] else 'warning')
+        return render_template('import_plants.html', summary=summary, formats=IMPORT_FORMATS)
+
+    return render_template('import_plants.html', summary=None, formats=IMPORT_FORMATS)
+
+@app.cli.command('import-plants')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--email', required=True, help='Account that will own the imported plants.')
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), help='Defaults to the file extension.')
+def import_plants_command(path, email, fmt):
+    """Import plants and watering history from a CSV or NDJSON file."""
+    user = users_collection.find_one({'email': email}, {'_id': 1})
+    if user is None:
+        raise click.ClickException(f'No user with email {email}.')
+
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        summary = import_plants(read_import_rows(stream, fmt or import_format(path)), user['_id'])
+
+    print(f"Read {summary['rows']} rows: imported {summary['plants']} plants and "
+          f"{summary['events']} care events, {summary['error_count']} errors.")
+    for error in summary['errors']:
+        print(f"  line {error['line']}: {error['message']}")
+    if summary['error_count'] > len(summary['errors']):
+        print(f"  ... and {summary['error_count'] - len(summary['errors'])} more.")
+
+# --- Watering Schedule ---
+def find_due_plants(user_id, days_ahead=0, limit=DUE_SOON_LIMIT):
+    """Plants of one user due within days_ahead days, most overdue first (user_next_due index)."""
+    as_of = datetime.now() + timedelta(days=days_ahead)
+    return list(plants_collection.find(
+        due_plants_query(as_of, user_id),
+        {'name': 1, 'species': 1, 'image_url': 1, 'last_watered': 1, 'next_due': 1}
+    ).sort('next_due', ASCENDING).limit(limit))
+
+@app.route('/due')
+@login_required
+def due_plants():
+    days_ahead = parse_days_ahead(request.args.get('days', 1))
+    plants = find_due_plants(ObjectId(current_user.id), days_ahead)
+    return render_template('due.html', plants=plants, days_ahead=days_ahead, now=datetime.now())
+
+@app.route('/api/due')
+@login_required
+def due_plants_api():
+    days_ahead = parse_days_ahead(request.args.get('days', 1))
+    plants = find_due_plants(ObjectId(current_user.id), days_ahead)
+    return jsonify([serialize_due_plant(plant) for plant in plants])
+
+@app.cli.command('overdue-reminders')
+def overdue_reminders_command():
+    """Lists every overdue plant across all users, most overdue first."""
+    overdue = plants_collection.find(
+        due_plants_query(datetime.now()),
+        {'user_id': 1, 'name': 1, 'next_due': 1}
+    ).sort('next_due', ASCENDING).batch_size(1000)
+
+    count = 0
+    users = set()
+    for plant in overdue:
+        print(f"{plant['user_id']}\t{plant['_id']}\t{plant['name']}\tdue {plant['next_due']:%Y-%m-%d}")
+        users.add(plant['user_id'])
+        count += 1
+    print(f"{count} overdue plants for {len(users)} users.")
+
+@app.cli.command('backfill-next-due')
+def backfill_next_due_command():
+    """One-off: set watering_interval_days/next_due on plants created before they existed."""
+    updated = 0
+    for species in list(SPECIES_CATALOG) + [None]:
+        query = {'next_due': {'$exists': False}}
+        if species:
+            query['species'] = species
+        interval = watering_interval(species)
+        result = plants_collection.update_many(query, [{'$set': {
+            **VERSION_BUMP,
+            'watering_interval_days': interval,
+            'next_due': {'$add': ['$last_watered', interval * MS_PER_DAY]}
+        }}])
+        updated += result.modified_count
+    print(f'Updated {updated} plants.')
+
 
 # --- Forum Routes (RESTORED) ---
+# The forum list has one version counter in site_versions, bumped by every new
+# post and reply, so the cached page is validated with a single lookup.
+def bump_forum_version(session=None):
+    site_versions_collection.update_one(FORUM_VERSION_KEY, {'$inc': VERSION_INC}, upsert=True, session=session)
+
+def forum_validator():
+    doc = site_versions_collection.find_one(FORUM_VERSION_KEY)
+    return 'forum', doc['version'] if doc else 0
+
 @app.route('/forum')
+@cached_page(forum_validator)
 def forum():
-    # Get all posts, sorted newest first
-    posts_cursor = forum_posts_collection.find()
-    posts = sorted(posts_cursor, key=lambda p: p.get('created_at', datetime.min), reverse=True)
-    return render_template('forum.html', posts=posts)
+    # One page of posts, newest first. Only an excerpt of the content is sent back.
+    cursor = None
+    token = request.args.get('after')
+    if token:
+        try:
+            cursor = decode_cursor(token)
+        except ValueError:
+            flash('Invalid page link.', 'error')
+            return redirect(url_for('forum'))
+
+    posts, next_token = fetch_page(
+        forum_posts_collection, {}, 'created_at',
+        cursor=cursor, page_size=FORUM_PAGE_SIZE, projection=FORUM_LIST_PROJECTION
+    )
+    return render_template('forum.html', posts=posts, next_token=next_token,
+                           is_first_page=cursor is None, excerpt_length=FORUM_EXCERPT_LENGTH)
+
+# --- Forum Replies ---
+def thread_namespace(post_id):
+    return f"forum:{post_id}"
+
+def thread_validator(post_id):
+    """Every reply bumps the post's version, so it covers the whole thread."""
+    post_id_obj = parse_post_id(post_id)
+    post = forum_posts_collection.find_one({'_id': post_id_obj}, {'version': 1}) if post_id_obj else None
+    return post and (thread_namespace(post_id), post.get('version', 0))
+
+@app.route('/forum/<string:post_id>')
+@cached_page(thread_validator)
+def forum_thread(post_id):
+    post_id_obj = parse_post_id(post_id)
+    post = forum_posts_collection.find_one({'_id': post_id_obj}, FORUM_POST_PROJECTION) if post_id_obj else None
+    if not post:
+        flash('Post not found.', 'error')
+        return redirect(url_for('forum'))
+
+    cursor = None
+    token = request.args.get('after')
+    if token:
+        try:
+            cursor = decode_cursor(token)
+        except ValueError:
+            flash('Invalid page link.', 'error')
+            return redirect(url_for('forum_thread', post_id=post_id))
+
+    # Oldest first, so the conversation reads top to bottom
+    replies, next_token = fetch_page(
+        forum_replies_collection, {'post_id': post_id_obj}, 'created_at',
+        cursor=cursor, page_size=FORUM_REPLY_PAGE_SIZE, direction=ASCENDING
+    )
+    return render_template('forum_thread.html', post=post, replies=replies,
+                           next_token=next_token, is_first_page=cursor is None)
+
+@app.route('/forum/<string:post_id>/reply', methods=['POST'])
+@login_required
+def reply_to_post(post_id):
+    post_id_obj = parse_post_id(post_id)
+    content = request.form.get('content', '').strip()
+    if not content:
+        flash('A reply cannot be empty.', 'warning')
+        return redirect(url_for('forum_thread', post_id=post_id))
+
+    reply = {
+        '_id': ObjectId(),
+        'post_id': post_id_obj,
+        'user_id': ObjectId(current_user.id),
+        'username': current_user.username,
+        'content': content,
+        'created_at': datetime.now()
+    }
+
+    def add_reply(session):
+        result = forum_posts_collection.update_one(
+            {'_id': post_id_obj}, add_reply_update(reply), session=session
+        )
+        if result.matched_count == 0:
+            return False
+        forum_replies_collection.insert_one(reply, session=session)
+        bump_forum_version(session=session)
+        return True
+
+    if not post_id_obj or not run_in_transaction(add_reply):
+        flash('Post not found.', 'error')
+        return redirect(url_for('forum'))
+
+    return redirect(url_for('forum_thread', post_id=post_id))
+
+# --- Forum Search ---
+@app.route('/forum/search')
+def forum_search():
+    query = request.args.get('q', '').strip()
+    page = parse_search_page(request.args.get('page', 1))
+    posts, has_next = [], False
+
+    if query:
+        # Relevance order comes from the text index; title matches weigh 5x content matches
+        posts = list(forum_posts_collection.find(
+            {'$text': {'$search': query}}, FORUM_SEARCH_PROJECTION
+        ).sort([('score', {'$meta': 'textScore'}), ('_id', DESCENDING)])
+         .skip((page - 1) * SEARCH_PAGE_SIZE)
+         .limit(SEARCH_PAGE_SIZE + 1))
+        has_next = len(posts) > SEARCH_PAGE_SIZE and page < SEARCH_MAX_PAGES
+        posts = format_search_results(posts[:SEARCH_PAGE_SIZE], search_terms(query))
+
+    return render_template('forum_search.html', query=query, posts=posts,
+                           page=page, has_next=has_next)
 
 @app.route('/forum/new', methods=['GET', 'POST'])
 @login_required
@@ -308,13 +1401,133 @@ def create_post():
             'username': current_user.username,
             'title': title,
             'content': content,
-            'created_at': datetime.now()
+            'created_at': datetime.now(),
+            'reply_count': 0,
+            'latest_replies': []
         }
         forum_posts_collection.insert_one(post_document)
+        bump_forum_version()
         return redirect(url_for('forum'))
         
     return render_template('create_post.html')
 
+# --- JSON API ---
+@app.errorhandler(ApiError)
+def api_error(e):
+    return jsonify({'error': e.message}), e.status
+
+def api_login_required(view):
+    """login_required for the API: a 401 instead of a redirect to the login page."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not current_user.is_authenticated:
+            raise ApiError(401, 'Login required.')
+        return view(*args, **kwargs)
+    return wrapped
+
+def versioned_response(check_versions, load):
+    """
+    check_versions() returns the (id, version) pairs the response depends on,
+    read with a versions-only query; load() builds the payload and only runs
+    when the client's copy is out of date.
+    """
+    etag = api_etag(current_user.get_id(), request.full_path, check_versions())
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(dump_json(load()), mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+def api_collection(collection, query, fields):
+    """A batch (?ids=) or a page (?after=, ?limit=) of a collection, newest first."""
+    ids = api_ids(request.args)
+    if ids:
+        query = {**query, '_id': {'$in': ids}}
+        return versioned_response(
+            lambda: document_versions(collection.find(query, {'version': 1})),
+            lambda: batch_payload(collection.find(query, api_projection(fields)), ids, fields)
+        )
+
+    cursor = api_cursor(request.args)
+    page_size = api_page_size(request.args)
+
+    def page(projection):
+        return fetch_page(collection, query, 'created_at', cursor=cursor,
+                          page_size=page_size, projection=projection)
+
+    def load():
+        docs, next_token = page(api_projection(fields, 'created_at'))
+        return {'data': [api_document(doc, fields) for doc in docs], 'next': next_token}
+
+    return versioned_response(lambda: document_versions(page({'version': 1, 'created_at': 1})[0]), load)
+
+def api_single(collection, query, fields, what):
+    def check_versions():
+        doc = collection.find_one(query, {'version': 1})
+        if not doc:
+            raise ApiError(404, f'{what} not found.')
+        return document_versions([doc])
+
+    def load():
+        doc = collection.find_one(query, api_projection(fields))
+        if not doc:
+            raise ApiError(404, f'{what} not found.')
+        return {'data': api_document(doc, fields)}
+
+    return versioned_response(check_versions, load)
+
+@app.route(f'{API_PREFIX}/plants')
+@api_login_required
+def api_plants():
+    fields = api_fields(request.args, PLANT_API_FIELDS)
+    return api_collection(plants_collection, {'user_id': ObjectId(current_user.id)}, fields)
+
+@app.route(f'{API_PREFIX}/plants/<string:plant_id>')
+@api_login_required
+def api_plant(plant_id):
+    fields = api_fields(request.args, PLANT_API_FIELDS)
+    query = {'_id': api_object_id(plant_id, 'Plant'), 'user_id': ObjectId(current_user.id)}
+    return api_single(plants_collection, query, fields, 'Plant')
+
+@app.route(f'{API_PREFIX}/plants/<string:plant_id>/care-events')
+@api_login_required
+def api_care_events(plant_id):
+    fields = api_fields(request.args, CARE_EVENT_API_FIELDS)
+    plant_id_obj = api_object_id(plant_id, 'Plant')
+    owner_id = ObjectId(current_user.id)
+    cursor = api_cursor(request.args)
+    page_size = api_page_size(request.args)
+
+    # Every watering bumps the plant's version, so it also versions the history
+    def check_versions():
+        plant = plants_collection.find_one({'_id': plant_id_obj, 'user_id': owner_id}, {'version': 1})
+        if not plant:
+            raise ApiError(404, 'Plant not found.')
+        return document_versions([plant])
+
+    def load():
+        events, next_token = fetch_care_history(plant_id_obj, owner_id, cursor=cursor, page_size=page_size)
+        if cursor is None:
+            events = with_pending_care_events(events, plant_id_obj, owner_id)
+        return {'data': [api_document(event, fields) for event in events], 'next': next_token}
+
+    return versioned_response(check_versions, load)
+
+@app.route(f'{API_PREFIX}/forum/posts')
+def api_forum_posts():
+    fields = api_fields(request.args, FORUM_POST_API_FIELDS)
+    return api_collection(forum_posts_collection, {}, fields)
+
+@app.route(f'{API_PREFIX}/forum/posts/<string:post_id>')
+def api_forum_post(post_id):
+    fields = api_fields(request.args, FORUM_POST_API_FIELDS)
+    query = {'_id': api_object_id(post_id, 'Post')}
+    return api_single(forum_posts_collection, query, fields, 'Post')
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5002))
     
@@ -0,0 +1,979 @@
+"""
+Async serving mode for PlantCare Connect.
+
+Same routes and templates as app.py, but served by Quart on an event loop with
+pymongo's AsyncMongoClient, so a request waiting on MongoDB does not pin a
+worker thread. Pure helpers (queries, update pipelines, page tokens, species
+catalog) come from shared.py, which app.py uses too; this module never imports app.py.
+
+Run with:  hypercorn asgi_app:app --bind 0.0.0.0:5002
+"""
+import io
+import os
+import mimetypes
+import asyncio
+from functools import wraps
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from quart import Quart, render_template, request, redirect, url_for, flash, jsonify, session, g
+from quart.utils import run_sync
+from pymongo import AsyncMongoClient, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from bson.objectid import ObjectId
+from werkzeug.security import generate_password_hash, check_password_hash
+from flask_login import AnonymousUserMixin
+
+from shared import (
+    User, UserCache, SPECIES_IMAGES, DEFAULT_IMAGE, FORUM_PAGE_SIZE, FORUM_EXCERPT_LENGTH,
+    FORUM_LIST_PROJECTION, HISTORY_PAGE_SIZE, DUE_SOON_LIMIT, IMAGE_CACHE_MAX_AGE,
+    encode_cursor, decode_cursor, keyset_filter, parse_object_ids, initial_care_stats,
+    care_stats_update, care_stats_summary, month_start, bucket_upsert, watering_interval,
+    next_due_date, due_plants_query, serialize_due_plant, parse_days_ahead,
+    HashingOverloaded, get_hash_executor, discard_hash_executor, submit_hash_job, needs_rehash,
+    PASSWORD_HASH_METHOD, HASH_TIMEOUT, HASHING_FORM_TEMPLATES, CARE_EVENTS_STORAGE,
+    startup_image_manifest, startup_asset_manifest,
+    SEARCH_PAGE_SIZE, SEARCH_MAX_PAGES, FORUM_SEARCH_PROJECTION, parse_search_page,
+    search_terms, format_search_results, parse_plant_filters, plant_facet_pipeline,
+    plant_page_query, plant_page_skip, PLANT_PAGE_SORT, PLANTS_PAGE_SIZE,
+    unpack_plant_facets, EXPORT_BATCH_SIZE, PLANT_EXPORT_FIELDS, CARE_EVENT_EXPORT_FIELDS,
+    PLANT_EXPORT_PROJECTION, export_query, plant_export_row, care_event_export_row,
+    ExportEncoder, gzip_compressor, export_headers, IMPORT_FORMATS, import_format,
+    read_import_rows, new_import_summary, import_chunks, failed_import_plants, imported_events,
+    imported_event_documents, lost_imported_events, VERSION_INC, FORUM_VERSION_KEY, FORUM_POST_PROJECTION, FORUM_REPLY_PAGE_SIZE, add_reply_update,
+    parse_post_id, API_PREFIX, PLANT_API_FIELDS, CARE_EVENT_API_FIELDS, FORUM_POST_API_FIELDS,
+    ApiError, dump_json, api_object_id, api_fields, api_ids, api_page_size, api_cursor,
+    api_projection, api_document, document_versions, api_etag, batch_payload
+)
+from image_derivatives import picture_sources, DERIVED_DIR
+from mongo_client import client_options
+from static_assets import fingerprinted_path, precompressed_variant, encodings_by_path, ASSETS_DIR
+
+# --- App Setup ---
+app = Quart(__name__)
+app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default_fallback_key_for_dev')
+
+# --- Database Setup ---
+# The async client is bound to the event loop, so it is created when the server starts.
+mongo = {}
+
+@app.before_serving
+async def connect_db():
+    client = AsyncMongoClient(os.getenv('MONGO_URI'), **client_options())
+    db = client[os.getenv('MONGO_DB_NAME', 'plant_watering_db')]
+    mongo.update(
+        client=client,
+        plants=db.plants,
+        users=db.users,
+        care_events=db.care_events,
+        care_event_buckets=db.care_event_buckets,
+        care_event_archive=db.care_event_archive,
+        care_event_summaries=db.care_event_yearly_summaries,
+        forum_posts=db.forum_posts,
+        forum_replies=db.forum_replies,
+        site_versions=db.site_versions
+    )
+
+@app.after_serving
+async def close_db():
+    await mongo['client'].close()
+
+transactions_enabled = os.getenv('MONGO_TRANSACTIONS', '1') == '1'
+
+async def run_in_transaction(callback):
+    """Async counterpart of app.run_in_transaction."""
+    global transactions_enabled
+    if transactions_enabled:
+        try:
+            async with mongo['client'].start_session() as db_session:
+                return await db_session.with_transaction(callback)
+        except OperationFailure as e:
+            if e.code != 20:  # IllegalOperation: not a replica set member or mongos
+                raise
+            transactions_enabled = False
+    return await callback(None)
+
+async def fetch_page(collection, query, field, cursor=None, page_size=20, projection=None,
+                     direction=DESCENDING):
+    if cursor:
+        query = {'$and': [query, keyset_filter(field, cursor, direction)]}
+    docs = await (collection.find(query, projection)
+                  .sort([(field, direction), ('_id', direction)])
+                  .limit(page_size + 1)
+                  .to_list())
+    next_token = None
+    if len(docs) > page_size:
+        docs = docs[:page_size]
+        next_token = encode_cursor(docs[-1][field], docs[-1]['_id'])
+    return docs, next_token
+
+# --- Care Event Storage ---
+async def record_care_events(events, db_session=None):
+    if CARE_EVENTS_STORAGE == 'buckets':
+        for event in events:
+            event.setdefault('_id', ObjectId())
+        await mongo['care_event_buckets'].bulk_write(
+            [bucket_upsert(event) for event in events], ordered=True, session=db_session
+        )
+    else:
+        await mongo['care_events'].insert_many(events, session=db_session)
+
+async def delete_care_events(query, db_session=None):
+    collection = 'care_event_buckets' if CARE_EVENTS_STORAGE == 'buckets' else 'care_events'
+    await mongo[collection].delete_many(query, session=db_session)
+    await mongo['care_event_archive'].delete_many(query, session=db_session)
+    await mongo['care_event_summaries'].delete_many(query, session=db_session)
+
+async def fetch_care_history(plant_id, user_id, cursor=None, page_size=HISTORY_PAGE_SIZE):
+    query = {'plant_id': plant_id, 'user_id': user_id}
+    if CARE_EVENTS_STORAGE != 'buckets':
+        return await fetch_page(mongo['care_events'], query, 'event_date',
+                                cursor=cursor, page_size=page_size)
+
+    if cursor:
+        query['month'] = {'$lte': month_start(cursor[0])}
+    buckets = mongo['care_event_buckets'].find(
+        query, {'month': 1, 'events': 1}
+    ).sort('month', DESCENDING).batch_size(4)
+
+    events, month, month_events = [], None, []
+
+    def close_month():
+        month_events.sort(key=lambda e: (e['event_date'], e['_id']), reverse=True)
+        events.extend(e for e in month_events
+                      if not cursor or (e['event_date'], e['_id']) < cursor)
+        month_events.clear()
+
+    async for bucket in buckets:
+        if bucket['month'] != month:
+            close_month()
+            if len(events) > page_size:
+                break
+            month = bucket['month']
+        month_events.extend(bucket['events'])
+    else:
+        close_month()
+
+    next_token = None
+    if len(events) > page_size:
+        events = events[:page_size]
+        next_token = encode_cursor(events[-1]['event_date'], events[-1]['_id'])
+    return events, next_token
+
+async def iter_care_events(plant_id, user_id, batch_size=500):
+    """Async counterpart of app.iter_care_events: every event of a plant, oldest first."""
+    query = {'plant_id': plant_id, 'user_id': user_id}
+    async for event in mongo['care_event_archive'].find(query).sort(
+            [('event_date', ASCENDING), ('_id', ASCENDING)]).batch_size(batch_size):
+        yield event
+    if CARE_EVENTS_STORAGE != 'buckets':
+        async for event in mongo['care_events'].find(query).sort(
+                [('event_date', ASCENDING), ('_id', ASCENDING)]).batch_size(batch_size):
+            yield event
+        return
+
+    buckets = mongo['care_event_buckets'].find(
+        query, {'month': 1, 'events': 1}
+    ).sort('month', ASCENDING).batch_size(4)
+    month, month_events = None, []
+    async for bucket in buckets:
+        if bucket['month'] != month:
+            month_events.sort(key=lambda e: (e['event_date'], e['_id']))
+            for event in month_events:
+                yield event
+            month, month_events = bucket['month'], []
+        month_events.extend(bucket['events'])
+    month_events.sort(key=lambda e: (e['event_date'], e['_id']))
+    for event in month_events:
+        yield event
+
+# --- Templates & Static Files ---
+# Loaded (and built if needed, as app.py does on import) when the server starts
+image_manifest = {}
+asset_manifest = {}
+asset_encodings = {}
+
+@app.before_serving
+async def load_static_manifests():
+    global image_manifest, asset_manifest, asset_encodings
+    image_manifest = await run_sync(startup_image_manifest)(app.static_folder)
+    asset_manifest = await run_sync(startup_asset_manifest)(app.static_folder)
+    asset_encodings = encodings_by_path(asset_manifest)
+
+@app.template_global()
+def image_variants(image_url):
+    return picture_sources(image_manifest, image_url,
+                           lambda path: url_for('static', filename=path))
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint == 'static' and asset_manifest and not app.debug:
+        values['filename'] = fingerprinted_path(asset_manifest, values.get('filename'))
+
+async def send_static_asset(filename):
+    path, encoding = precompressed_variant(asset_encodings, filename, request.accept_encodings)
+    response = await app.send_static_file(path)
+    if filename in asset_encodings:
+        response.vary.add('Accept-Encoding')
+    if encoding:
+        response.content_encoding = encoding
+        response.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    return response
+
+app.view_functions['static'] = send_static_asset
+
+@app.after_request
+async def cache_fingerprinted_files(response):
+    fingerprinted_dirs = (f"{app.static_url_path}/{DERIVED_DIR}/", f"{app.static_url_path}/{ASSETS_DIR}/")
+    if request.path.startswith(fingerprinted_dirs) and response.status_code == 200:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMAGE_CACHE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+# --- Password Hashing ---
+# Uses the process pool and queue limit from shared.py; the loop only awaits the result.
+async def run_hash_job(fn, *args):
+    for _ in range(2):
+        executor = get_hash_executor()
+        try:
+            future = submit_hash_job(executor, fn, *args)
+            return await asyncio.wait_for(asyncio.wrap_future(future), HASH_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HashingOverloaded()
+        except BrokenProcessPool as e:
+            # A pool process died; replace the pool and retry once, like app.run_hash_job
+            print(f"Password hashing pool broke, replacing it: {e}")
+            discard_hash_executor(executor)
+    raise HashingOverloaded()
+
+async def hash_password(password):
+    return await run_hash_job(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+async def verify_password(password_hash, password):
+    return await run_hash_job(check_password_hash, password_hash, password)
+
+@app.errorhandler(HashingOverloaded)
+async def hashing_overloaded(e):
+    await flash('Too many sign-in requests right now. Please try again in a moment.', 'error')
+    template = HASHING_FORM_TEMPLATES.get(request.endpoint, 'login.html')
+    return await render_template(template), 503, {'Retry-After': '5'}
+
+# --- Login ---
+# Uses the same session key as Flask-Login, so a session cookie issued by either
+# serving mode is accepted by the other when they share SECRET_KEY.
+user_cache = UserCache(
+    maxsize=int(os.getenv('USER_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('USER_CACHE_TTL', 60))
+)
+anonymous_user = AnonymousUserMixin()
+
+async def get_current_user():
+    user_id = session.get('_user_id')
+    if not user_id or not ObjectId.is_valid(user_id):
+        return anonymous_user
+    user = user_cache.get(user_id)
+    if user is None:
+        user_data = await mongo['users'].find_one({'_id': ObjectId(user_id)})
+        if not user_data:
+            return anonymous_user
+        user = User(user_data)
+        user_cache.put(user)
+    return user
+
+@app.before_request
+async def load_current_user():
+    g.current_user = await get_current_user()
+
+@app.context_processor
+async def inject_current_user():
+    return {'current_user': g.current_user}
+
+def current_user():
+    return g.current_user
+
+def login_user(user):
+    user_cache.put(user)
+    session['_user_id'] = user.id
+    session['_fresh'] = True
+
+def login_required(view):
+    @wraps(view)
+    async def wrapped(*args, **kwargs):
+        if not current_user().is_authenticated:
+            return redirect(url_for('login', next=request.path))
+        return await view(*args, **kwargs)
+    return wrapped
+
+# --- Auth Routes ---
+@app.route('/register', methods=['GET', 'POST'])
+async def register():
+    if request.method == 'POST':
+        form = await request.form
+        username = form['username']
+        email = form['email']
+        password = form['password']
+
+        existing_user = await mongo['users'].find_one({'email': email}, {'_id': 1})
+        if existing_user:
+            await flash('Email already registered. Please log in.', 'error')
+            return redirect(url_for('login'))
+
+        password_hash = await hash_password(password)
+        user_data = {
+            'username': username,
+            'email': email,
+            'password_hash': password_hash
+        }
+        try:
+            user_data['_id'] = (await mongo['users'].insert_one(user_data)).inserted_id
+        except DuplicateKeyError:
+            await flash('Email already registered. Please log in.', 'error')
+            return redirect(url_for('login'))
+
+        login_user(User(user_data))
+        return redirect(url_for('index'))
+
+    return await render_template('register.html')
+
+@app.route('/login', methods=['GET', 'POST'])
+async def login():
+    if request.method == 'POST':
+        form = await request.form
+        email = form['email']
+        password = form['password']
+
+        user_data = await mongo['users'].find_one({'email': email})
+
+        if user_data and await verify_password(user_data['password_hash'], password):
+            if needs_rehash(user_data['password_hash']):
+                user_data['password_hash'] = await hash_password(password)
+                await mongo['users'].update_one(
+                    {'_id': user_data['_id']},
+                    {'$set': {'password_hash': user_data['password_hash']}}
+                )
+                user_cache.invalidate(user_data['_id'])
+            login_user(User(user_data))
+            return redirect(url_for('index'))
+        await flash('Invalid email or password.', 'error')
+
+    return await render_template('login.html')
+
+@app.route('/logout')
+@login_required
+async def logout():
+    user_cache.invalidate(current_user().id)
+    session.pop('_user_id', None)
+    session.pop('_fresh', None)
+    return redirect(url_for('index'))
+
+# --- Main App Routes ---
+@app.route('/')
+async def index():
+    filters = parse_plant_filters(request.args)
+    plants, result = [], []
+    if current_user().is_authenticated:
+        owner_id = ObjectId(current_user().id)
+        plants = await (mongo['plants'].find(plant_page_query(owner_id, filters))
+                        .sort(PLANT_PAGE_SORT)
+                        .skip(plant_page_skip(filters))
+                        .limit(PLANTS_PAGE_SIZE)
+                        .to_list())
+        cursor = await mongo['plants'].aggregate(plant_facet_pipeline(owner_id, filters))
+        result = await cursor.to_list()
+
+    return await render_template('index.html', **unpack_plant_facets(result, plants, filters))
+
+@app.route('/add', methods=['GET', 'POST'])
+@login_required
+async def add_plant():
+    available_species = list(SPECIES_IMAGES.keys())
+
+    if request.method == 'POST':
+        form = await request.form
+        plant_name = form['plant_name']
+        plant_species = form['plant_species']
+        last_watered_date = datetime.strptime(form['last_watered'], '%Y-%m-%d')
+        owner_id = ObjectId(current_user().id)
+
+        plant_document = {
+            'name': plant_name,
+            'name_lower': plant_name.lower(),
+            'species': plant_species,
+            'last_watered': last_watered_date,
+            'image_url': SPECIES_IMAGES.get(plant_species, DEFAULT_IMAGE),
+            'created_at': datetime.now(),
+            'user_id': owner_id,
+            'care_stats': initial_care_stats(last_watered_date),
+            'watering_interval_days': watering_interval(plant_species),
+            'next_due': next_due_date(last_watered_date, plant_species)
+        }
+        new_plant_id = (await mongo['plants'].insert_one(plant_document)).inserted_id
+
+        await record_care_events([{
+            'plant_id': new_plant_id,
+            'user_id': owner_id,
+            'event_type': 'water',
+            'event_date': last_watered_date,
+            'notes': 'Initial watering specified on creation.'
+        }])
+        return redirect(url_for('index'))
+
+    return await render_template('add_plant.html', species_list=available_species)
+
+@app.route('/edit/<string:plant_id>', methods=['GET', 'POST'])
+@login_required
+async def edit_plant(plant_id):
+    owner_filter = {'_id': ObjectId(plant_id), 'user_id': ObjectId(current_user().id)}
+    available_species = list(SPECIES_IMAGES.keys())
+
+    if request.method == 'POST':
+        form = await request.form
+        updated_species = form['plant_species']
+        updated_last_watered = datetime.strptime(form['last_watered'], '%Y-%m-%d')
+
+        result = await mongo['plants'].update_one(owner_filter, {'$set': {
+            'name': form['plant_name'],
+            'name_lower': form['plant_name'].lower(),
+            'species': updated_species,
+            'last_watered': updated_last_watered,
+            'image_url': SPECIES_IMAGES.get(updated_species, DEFAULT_IMAGE),
+            'watering_interval_days': watering_interval(updated_species),
+            'next_due': next_due_date(updated_last_watered, updated_species)
+        }, '$inc': VERSION_INC})
+        if result.matched_count == 0:
+            await flash('Plant not found or you do not have permission.', 'error')
+        return redirect(url_for('index'))
+
+    plant_to_edit = await mongo['plants'].find_one(owner_filter)
+    if not plant_to_edit:
+        await flash('Plant not found or you do not have permission.', 'error')
+        return redirect(url_for('index'))
+
+    return await render_template('edit_plant.html', plant=plant_to_edit, species_list=available_species)
+
+@app.route('/plant/<string:plant_id>')
+@login_required
+async def plant_detail(plant_id):
+    plant_id_obj = ObjectId(plant_id)
+    owner_id = ObjectId(current_user().id)
+    plant = await mongo['plants'].find_one({'_id': plant_id_obj, 'user_id': owner_id})
+
+    if not plant:
+        await flash('Plant not found or you do not have permission.', 'error')
+        return redirect(url_for('index'))
+
+    cursor = None
+    token = request.args.get('before')
+    if token:
+        try:
+            cursor = decode_cursor(token)
+        except ValueError:
+            await flash('Invalid page link.', 'error')
+            return redirect(url_for('plant_detail', plant_id=plant_id))
+
+    events, next_token = await fetch_care_history(plant_id_obj, owner_id, cursor=cursor)
+    return await render_template('plant_detail.html', plant=plant, events=events,
+                                 stats=care_stats_summary(plant), next_token=next_token,
+                                 is_first_page=cursor is None)
+
+@app.route('/plant/<string:plant_id>/archive')
+@login_required
+async def plant_archive(plant_id):
+    plant_id_obj = ObjectId(plant_id)
+    owner_id = ObjectId(current_user().id)
+    plant = await mongo['plants'].find_one({'_id': plant_id_obj, 'user_id': owner_id},
+                                           {'name': 1, 'archived_events': 1})
+
+    if not plant:
+        await flash('Plant not found or you do not have permission.', 'error')
+        return redirect(url_for('index'))
+
+    cursor = None
+    token = request.args.get('before')
+    if token:
+        try:
+            cursor = decode_cursor(token)
+        except ValueError:
+            await flash('Invalid page link.', 'error')
+            return redirect(url_for('plant_archive', plant_id=plant_id))
+
+    query = {'plant_id': plant_id_obj, 'user_id': owner_id}
+    summaries = []
+    if cursor is None:
+        summaries = await mongo['care_event_summaries'].find(query).sort('year', DESCENDING).to_list()
+    events, next_token = await fetch_page(mongo['care_event_archive'], query, 'event_date',
+                                          cursor=cursor, page_size=HISTORY_PAGE_SIZE)
+    return await render_template('plant_archive.html', plant=plant, summaries=summaries,
+                                 events=events, next_token=next_token, is_first_page=cursor is None)
+
+@app.route('/water/<string:plant_id>', methods=['POST'])
+@login_required
+async def water_plant(plant_id):
+    plant_id_obj = ObjectId(plant_id)
+    owner_id = ObjectId(current_user().id)
+    now = datetime.now()
+
+    async def water(db_session):
+        result = await mongo['plants'].update_one(
+            {'_id': plant_id_obj, 'user_id': owner_id},
+            care_stats_update(now),
+            session=db_session
+        )
+        if result.matched_count == 0:
+            return False
+        await record_care_events([{
+            'plant_id': plant_id_obj,
+            'user_id': owner_id,
+            'event_type': 'water',
+            'event_date': now
+        }], db_session)
+        return True
+
+    if not await run_in_transaction(water):
+        await flash('Plant not found or you do not have permission.', 'error')
+    return redirect(url_for('index'))
+
+@app.route('/delete/<string:plant_id>', methods=['POST'])
+@login_required
+async def delete_plant(plant_id):
+    plant_id_obj = ObjectId(plant_id)
+    owner_id = ObjectId(current_user().id)
+
+    async def delete(db_session):
+        result = await mongo['plants'].delete_one(
+            {'_id': plant_id_obj, 'user_id': owner_id}, session=db_session
+        )
+        if result.deleted_count == 0:
+            return False
+        await delete_care_events({'plant_id': plant_id_obj, 'user_id': owner_id}, db_session)
+        return True
+
+    if not await run_in_transaction(delete):
+        await flash('Plant not found or you do not have permission.', 'error')
+    return redirect(url_for('index'))
+
+@app.route('/delete_selected_plants', methods=['POST'])
+@login_required
+async def delete_selected_plants():
+    plant_ids = parse_object_ids((await request.form).getlist('plant_ids'))
+    if not plant_ids:
+        await flash('No plants selected for deletion.', 'warning')
+        return redirect(url_for('index'))
+
+    owner_id = ObjectId(current_user().id)
+
+    async def delete_plants(db_session):
+        result = await mongo['plants'].delete_many(
+            {'_id': {'$in': plant_ids}, 'user_id': owner_id}, session=db_session
+        )
+        await delete_care_events({'plant_id': {'$in': plant_ids}, 'user_id': owner_id}, db_session)
+        return result.deleted_count
+
+    deleted_count = await run_in_transaction(delete_plants)
+    await flash(f'Successfully deleted {deleted_count} selected plants.', 'info')
+    return redirect(url_for('index'))
+
+@app.route('/water_selected_plants', methods=['POST'])
+@login_required
+async def water_selected_plants():
+    plant_ids = parse_object_ids((await request.form).getlist('plant_ids'))
+    if not plant_ids:
+        await flash('No plants selected for watering.', 'warning')
+        return redirect(url_for('index'))
+
+    owner_id = ObjectId(current_user().id)
+    now = datetime.now()
+
+    async def water_plants(db_session):
+        owned_ids = [plant['_id'] for plant in await mongo['plants'].find(
+            {'_id': {'$in': plant_ids}, 'user_id': owner_id}, {'_id': 1}, session=db_session
+        ).to_list()]
+        if not owned_ids:
+            return 0
+        await mongo['plants'].update_many(
+            {'_id': {'$in': owned_ids}}, care_stats_update(now), session=db_session
+        )
+        await record_care_events([{
+            'plant_id': plant_id,
+            'user_id': owner_id,
+            'event_type': 'water',
+            'event_date': now
+        } for plant_id in owned_ids], db_session)
+        return len(owned_ids)
+
+    watered_count = await run_in_transaction(water_plants)
+    await flash(f'Watered {watered_count} selected plants.', 'info')
+    return redirect(url_for('index'))
+
+# --- Export ---
+async def plant_export_rows(owner_id, plant_id=None):
+    plants = mongo['plants'].find(
+        export_query(owner_id, plant_id), PLANT_EXPORT_PROJECTION
+    ).sort('created_at', ASCENDING).batch_size(EXPORT_BATCH_SIZE)
+    async for plant in plants:
+        yield plant_export_row(plant)
+
+async def care_event_export_rows(owner_id, plant_id=None):
+    plants = mongo['plants'].find(export_query(owner_id, plant_id), {'name': 1}).sort('created_at', ASCENDING)
+    async for plant in plants:
+        async for event in iter_care_events(plant['_id'], owner_id, batch_size=EXPORT_BATCH_SIZE):
+            yield care_event_export_row(plant, event)
+
+EXPORT_DATASETS = {
+    'plants': (plant_export_rows, PLANT_EXPORT_FIELDS),
+    'care-history': (care_event_export_rows, CARE_EVENT_EXPORT_FIELDS),
+}
+
+async def encode_export(rows, fmt, fields, gzip):
+    """Async counterpart of app.encode_export (and app.gzip_stream), yielding bytes."""
+    encoder = ExportEncoder(fmt, fields)
+    compressor = gzip_compressor() if gzip else None
+
+    def encode(text):
+        return compressor.compress(text.encode('utf-8')) if compressor else text.encode('utf-8')
+
+    async for row in rows:
+        chunk = encoder.write(row)
+        if chunk:
+            data = encode(chunk)
+            if data:
+                yield data
+    data = encode(encoder.take())
+    if compressor:
+        data += compressor.flush()
+    if data:
+        yield data
+
+@app.route('/export/<any(plants, "care-history"):dataset>.<any(csv, ndjson):fmt>')
+@login_required
+async def export_data(dataset, fmt):
+    plant_id = None
+    if request.args.get('plant'):
+        plant_ids = parse_object_ids([request.args['plant']])
+        if not plant_ids:
+            await flash('Invalid plant ID.', 'error')
+            return redirect(url_for('index'))
+        plant_id = plant_ids[0]
+
+    row_source, fields = EXPORT_DATASETS[dataset]
+    gzip = bool(request.accept_encodings['gzip'])
+    body = encode_export(row_source(ObjectId(current_user().id), plant_id), fmt, fields, gzip)
+    return body, 200, export_headers(dataset, fmt, gzip)
+
+# --- Bulk Import ---
+async def import_plants(rows, owner_id):
+    """Async counterpart of app.import_plants."""
+    summary = new_import_summary()
+    events_collection = mongo['care_event_buckets' if CARE_EVENTS_STORAGE == 'buckets' else 'care_events']
+    # Reading and parsing the upload blocks, so each chunk is read on a worker thread
+    chunks = import_chunks(rows, owner_id, summary)
+    next_chunk = run_sync(next)
+    while True:
+        chunk = await next_chunk(chunks, None)
+        if chunk is None:
+            break
+        failed = set()
+        try:
+            await mongo['plants'].insert_many([plant for _, plant, _ in chunk], ordered=False)
+        except BulkWriteError as e:
+            failed = failed_import_plants(summary, chunk, e)
+
+        events = imported_events(chunk, failed)
+        saved_events = len(events)
+        if events:
+            documents = imported_event_documents(events)
+            try:
+                await events_collection.insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                saved_events -= lost_imported_events(summary, chunk, documents, e)
+
+        summary['plants'] += len(chunk) - len(failed)
+        summary['events'] += saved_events
+    return summary
+
+@app.route('/import', methods=['GET', 'POST'])
+@login_required
+async def import_plants_view():
+    if request.method == 'POST':
+        files = await request.files
+        upload = files.get('file')
+        if not upload or not upload.filename:
+            await flash('Choose a CSV or NDJSON file to import.', 'error')
+            return redirect(url_for('import_plants_view'))
+
+        form = await request.form
+        fmt = import_format(upload.filename, form.get('format', 'csv'))
+        owner_id = ObjectId(current_user().id)
+
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        summary = await import_plants(read_import_rows(stream, fmt), owner_id)
+        await flash(f"Imported {summary['plants']} plants and {summary['events']} care events.",
+                    'info' if not summary['error_count'] else 'warning')
+        return await render_template('import_plants.html', summary=summary, formats=IMPORT_FORMATS)
+
+    return await render_template('import_plants.html', summary=None, formats=IMPORT_FORMATS)
+
+# --- Watering Schedule ---
+async def find_due_plants(user_id, days_ahead=0, limit=DUE_SOON_LIMIT):
+    as_of = datetime.now() + timedelta(days=days_ahead)
+    return await mongo['plants'].find(
+        due_plants_query(as_of, user_id),
+        {'name': 1, 'species': 1, 'image_url': 1, 'last_watered': 1, 'next_due': 1}
+    ).sort('next_due', ASCENDING).limit(limit).to_list()
+
+@app.route('/due')
+@login_required
+async def due_plants():
+    days_ahead = parse_days_ahead(request.args.get('days', 1))
+    plants = await find_due_plants(ObjectId(current_user().id), days_ahead)
+    return await render_template('due.html', plants=plants, days_ahead=days_ahead, now=datetime.now())
+
+@app.route('/api/due')
+@login_required
+async def due_plants_api():
+    days_ahead = parse_days_ahead(request.args.get('days', 1))
+    plants = await find_due_plants(ObjectId(current_user().id), days_ahead)
+    return jsonify([serialize_due_plant(plant) for plant in plants])
+
+# --- Forum Routes ---
+async def bump_forum_version(db_session=None):
+    # Keeps the sync app's cached forum page in step (see app.forum_validator)
+    await mongo['site_versions'].update_one(FORUM_VERSION_KEY, {'$inc': VERSION_INC},
+                                            upsert=True, session=db_session)
+
+@app.route('/forum')
+async def forum():
+    cursor = None
+    token = request.args.get('after')
+    if token:
+        try:
+            cursor = decode_cursor(token)
+        except ValueError:
+            await flash('Invalid page link.', 'error')
+            return redirect(url_for('forum'))
+
+    posts, next_token = await fetch_page(
+        mongo['forum_posts'], {}, 'created_at',
+        cursor=cursor, page_size=FORUM_PAGE_SIZE, projection=FORUM_LIST_PROJECTION
+    )
+    return await render_template('forum.html', posts=posts, next_token=next_token,
+                                 is_first_page=cursor is None, excerpt_length=FORUM_EXCERPT_LENGTH)
+
+@app.route('/forum/<string:post_id>')
+async def forum_thread(post_id):
+    post_id_obj = parse_post_id(post_id)
+    post = None
+    if post_id_obj:
+        post = await mongo['forum_posts'].find_one({'_id': post_id_obj}, FORUM_POST_PROJECTION)
+    if not post:
+        await flash('Post not found.', 'error')
+        return redirect(url_for('forum'))
+
+    cursor = None
+    token = request.args.get('after')
+    if token:
+        try:
+            cursor = decode_cursor(token)
+        except ValueError:
+            await flash('Invalid page link.', 'error')
+            return redirect(url_for('forum_thread', post_id=post_id))
+
+    replies, next_token = await fetch_page(
+        mongo['forum_replies'], {'post_id': post_id_obj}, 'created_at',
+        cursor=cursor, page_size=FORUM_REPLY_PAGE_SIZE, direction=ASCENDING
+    )
+    return await render_template('forum_thread.html', post=post, replies=replies,
+                                 next_token=next_token, is_first_page=cursor is None)
+
+@app.route('/forum/<string:post_id>/reply', methods=['POST'])
+@login_required
+async def reply_to_post(post_id):
+    post_id_obj = parse_post_id(post_id)
+    content = (await request.form).get('content', '').strip()
+    if not content:
+        await flash('A reply cannot be empty.', 'warning')
+        return redirect(url_for('forum_thread', post_id=post_id))
+
+    reply = {
+        '_id': ObjectId(),
+        'post_id': post_id_obj,
+        'user_id': ObjectId(current_user().id),
+        'username': current_user().username,
+        'content': content,
+        'created_at': datetime.now()
+    }
+
+    async def add_reply(db_session):
+        result = await mongo['forum_posts'].update_one(
+            {'_id': post_id_obj}, add_reply_update(reply), session=db_session
+        )
+        if result.matched_count == 0:
+            return False
+        await mongo['forum_replies'].insert_one(reply, session=db_session)
+        await bump_forum_version(db_session)
+        return True
+
+    if not post_id_obj or not await run_in_transaction(add_reply):
+        await flash('Post not found.', 'error')
+        return redirect(url_for('forum'))
+    return redirect(url_for('forum_thread', post_id=post_id))
+
+@app.route('/forum/search')
+async def forum_search():
+    query = request.args.get('q', '').strip()
+    page = parse_search_page(request.args.get('page', 1))
+    posts, has_next = [], False
+
+    if query:
+        posts = await (mongo['forum_posts'].find(
+            {'$text': {'$search': query}}, FORUM_SEARCH_PROJECTION
+        ).sort([('score', {'$meta': 'textScore'}), ('_id', DESCENDING)])
+         .skip((page - 1) * SEARCH_PAGE_SIZE)
+         .limit(SEARCH_PAGE_SIZE + 1)
+         .to_list())
+        has_next = len(posts) > SEARCH_PAGE_SIZE and page < SEARCH_MAX_PAGES
+        posts = format_search_results(posts[:SEARCH_PAGE_SIZE], search_terms(query))
+
+    return await render_template('forum_search.html', query=query, posts=posts,
+                                 page=page, has_next=has_next)
+
+@app.route('/forum/new', methods=['GET', 'POST'])
+@login_required
+async def create_post():
+    if request.method == 'POST':
+        form = await request.form
+        await mongo['forum_posts'].insert_one({
+            'user_id': ObjectId(current_user().id),
+            'username': current_user().username,
+            'title': form['title'],
+            'content': form['content'],
+            'created_at': datetime.now(),
+            'reply_count': 0,
+            'latest_replies': []
+        })
+        await bump_forum_version()
+        return redirect(url_for('forum'))
+
+    return await render_template('create_post.html')
+
+# --- JSON API ---
+@app.errorhandler(ApiError)
+async def api_error(e):
+    return jsonify({'error': e.message}), e.status
+
+def api_login_required(view):
+    @wraps(view)
+    async def wrapped(*args, **kwargs):
+        if not current_user().is_authenticated:
+            raise ApiError(401, 'Login required.')
+        return await view(*args, **kwargs)
+    return wrapped
+
+async def versioned_response(check_versions, load):
+    """Async counterpart of app.versioned_response."""
+    etag = api_etag(current_user().get_id(), request.full_path, await check_versions())
+    if request.if_none_match.contains(etag):
+        response = app.response_class('', status=304)
+    else:
+        response = app.response_class(dump_json(await load()), mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+async def api_collection(collection, query, fields):
+    ids = api_ids(request.args)
+    if ids:
+        query = {**query, '_id': {'$in': ids}}
+
+        async def check_batch():
+            return document_versions(await collection.find(query, {'version': 1}).to_list())
+
+        async def load_batch():
+            return batch_payload(await collection.find(query, api_projection(fields)).to_list(), ids, fields)
+
+        return await versioned_response(check_batch, load_batch)
+
+    cursor = api_cursor(request.args)
+    page_size = api_page_size(request.args)
+
+    def page(projection):
+        return fetch_page(collection, query, 'created_at', cursor=cursor,
+                          page_size=page_size, projection=projection)
+
+    async def check_page():
+        docs, _ = await page({'version': 1, 'created_at': 1})
+        return document_versions(docs)
+
+    async def load_page():
+        docs, next_token = await page(api_projection(fields, 'created_at'))
+        return {'data': [api_document(doc, fields) for doc in docs], 'next': next_token}
+
+    return await versioned_response(check_page, load_page)
+
+async def api_single(collection, query, fields, what):
+    async def check_versions():
+        doc = await collection.find_one(query, {'version': 1})
+        if not doc:
+            raise ApiError(404, f'{what} not found.')
+        return document_versions([doc])
+
+    async def load():
+        doc = await collection.find_one(query, api_projection(fields))
+        if not doc:
+            raise ApiError(404, f'{what} not found.')
+        return {'data': api_document(doc, fields)}
+
+    return await versioned_response(check_versions, load)
+
+@app.route(f'{API_PREFIX}/plants')
+@api_login_required
+async def api_plants():
+    fields = api_fields(request.args, PLANT_API_FIELDS)
+    return await api_collection(mongo['plants'], {'user_id': ObjectId(current_user().id)}, fields)
+
+@app.route(f'{API_PREFIX}/plants/<string:plant_id>')
+@api_login_required
+async def api_plant(plant_id):
+    fields = api_fields(request.args, PLANT_API_FIELDS)
+    query = {'_id': api_object_id(plant_id, 'Plant'), 'user_id': ObjectId(current_user().id)}
+    return await api_single(mongo['plants'], query, fields, 'Plant')
+
+@app.route(f'{API_PREFIX}/plants/<string:plant_id>/care-events')
+@api_login_required
+async def api_care_events(plant_id):
+    fields = api_fields(request.args, CARE_EVENT_API_FIELDS)
+    plant_id_obj = api_object_id(plant_id, 'Plant')
+    owner_id = ObjectId(current_user().id)
+    cursor = api_cursor(request.args)
+    page_size = api_page_size(request.args)
+
+    async def check_versions():
+        plant = await mongo['plants'].find_one({'_id': plant_id_obj, 'user_id': owner_id}, {'version': 1})
+        if not plant:
+            raise ApiError(404, 'Plant not found.')
+        return document_versions([plant])
+
+    async def load():
+        events, next_token = await fetch_care_history(plant_id_obj, owner_id, cursor=cursor,
+                                                      page_size=page_size)
+        return {'data': [api_document(event, fields) for event in events], 'next': next_token}
+
+    return await versioned_response(check_versions, load)
+
+@app.route(f'{API_PREFIX}/forum/posts')
+async def api_forum_posts():
+    fields = api_fields(request.args, FORUM_POST_API_FIELDS)
+    return await api_collection(mongo['forum_posts'], {}, fields)
+
+@app.route(f'{API_PREFIX}/forum/posts/<string:post_id>')
+async def api_forum_post(post_id):
+    fields = api_fields(request.args, FORUM_POST_API_FIELDS)
+    query = {'_id': api_object_id(post_id, 'Post')}
+    return await api_single(mongo['forum_posts'], query, fields, 'Post')
+
+if __name__ == '__main__':
+    port = int(os.environ.get("PORT", 5002))
+    app.run(host='0.0.0.0', port=port)
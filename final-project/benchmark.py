@@ -0,0 +1,347 @@
+"""
+Load test for the plant app. Seeds a dataset in a dedicated database, drives
+each route through the WSGI app at a fixed concurrency and prints the results
+as JSON (throughput, latency percentiles and MongoDB round trips per route),
+so runs on different commits can be diffed.
+
+    python benchmark.py --users 20 --plants 50 --events 30 --posts 500 \
+        --concurrency 8 --requests 400 --output bench.json
+
+Runs against MONGO_URI (or --mongo-uri), or against a throwaway mongod started
+by pymongo_inmemory with --in-memory. The benchmark database is dropped and
+re-seeded on every run.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from pymongo import monitoring
+
+DEFAULT_DB_NAME = 'plant_watering_bench'
+PASSWORD = 'bench-password'
+BULK_DELETE_SIZE = 5
+ROUTES = ('login', 'index', 'add', 'water', 'detail', 'forum', 'bulk_delete')
+
+
+# --- Round Trip Counting ---
+
+class RoundTripCounter(monitoring.CommandListener):
+    """Counts commands sent to MongoDB by the current thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def started(self, event):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def take(self):
+        count = getattr(self._local, 'count', 0)
+        self._local.count = 0
+        return count
+
+
+# --- Results ---
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile, so results do not depend on interpolation choices
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(s['latency'] * 1000 for s in samples)
+    round_trips = [s['round_trips'] for s in samples]
+    errors = sum(1 for s in samples if s['status'] >= 400)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 3) if latencies else None,
+            'p95': round(percentile(latencies, 95), 3) if latencies else None,
+            'p99': round(percentile(latencies, 99), 3) if latencies else None,
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'max': round(latencies[-1], 3) if latencies else None,
+        },
+        'db_round_trips': {
+            'total': sum(round_trips),
+            'per_request': round(sum(round_trips) / len(round_trips), 2) if round_trips else None,
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- Seeding ---
+
+def seed(app_module, args, rng):
+    """Drops the benchmark collections and inserts users, plants, care events and posts."""
+    from bson import ObjectId
+    from werkzeug.security import generate_password_hash
+
+    db = app_module.mongo.db
+    for name in db.list_collection_names():
+        db.drop_collection(name)
+    app_module.ensure_indexes()
+
+    # Every account shares one hash; hashing is measured by the login route instead
+    password_hash = generate_password_hash(PASSWORD, app_module.PASSWORD_HASH_METHOD)
+    users = [{
+        '_id': ObjectId(),
+        'username': f'bench{i}',
+        'email': f'bench{i}@example.com',
+        'password_hash': password_hash
+    } for i in range(args.users)]
+    app_module.users_collection.insert_many(users)
+
+    species = list(app_module.SPECIES_IMAGES.keys())
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    plants_by_user = {}
+    for user in users:
+        plants, events = [], []
+        for p in range(args.plants):
+            plant_species = rng.choice(species)
+            first_watered = today - timedelta(days=args.events * 3 + rng.randrange(30))
+            dates = sorted(first_watered + timedelta(days=rng.randrange(args.events * 3 + 1))
+                           for _ in range(args.events))
+            last_watered = dates[-1] if dates else first_watered
+            plant_id = ObjectId()
+            stats = app_module.initial_care_stats(dates[0] if dates else first_watered)
+            stats['total_waterings'] = len(dates)
+            stats['last_event'] = last_watered
+            stats['longest_gap_seconds'] = max(
+                ((b - a).total_seconds() for a, b in zip(dates, dates[1:])), default=0
+            )
+            plants.append({
+                '_id': plant_id,
+                'name': f'Plant {p}',
+                'name_lower': f'plant {p}',
+                'species': plant_species,
+                'last_watered': last_watered,
+                'image_url': app_module.SPECIES_IMAGES[plant_species],
+                'created_at': first_watered,
+                'user_id': user['_id'],
+                'care_stats': stats,
+                'watering_interval_days': app_module.watering_interval(plant_species),
+                'next_due': app_module.next_due_date(last_watered, plant_species)
+            })
+            events.extend({
+                'plant_id': plant_id,
+                'user_id': user['_id'],
+                'event_type': 'water',
+                'event_date': date,
+                'notes': 'Seeded by benchmark.'
+            } for date in dates)
+        if plants:
+            app_module.plants_collection.insert_many(plants)
+        if events:
+            app_module.record_care_events(events)
+        plants_by_user[user['email']] = [str(plant['_id']) for plant in plants]
+
+    posts = [{
+        'user_id': rng.choice(users)['_id'],
+        'username': 'bench',
+        'title': f'Benchmark post {i}',
+        'content': ' '.join(rng.choice(('water', 'leaf', 'soil', 'light', 'pot', 'root'))
+                            for _ in range(rng.randrange(20, 200))),
+        'created_at': today - timedelta(minutes=i)
+    } for i in range(args.posts)]
+    if posts:
+        app_module.forum_posts_collection.insert_many(posts)
+
+    return [(user['email'], plants_by_user[user['email']]) for user in users]
+
+
+# --- Load ---
+
+class Worker:
+    """One simulated browser: its own cookie jar, account and plants."""
+
+    def __init__(self, app_module, email, plant_ids, rng):
+        self.client = app_module.app.test_client()
+        self.email = email
+        self.plant_ids = list(plant_ids)
+        self.rng = rng
+
+    def login(self):
+        return self.client.post('/login', data={'email': self.email, 'password': PASSWORD})
+
+    def request(self, route):
+        if route == 'login':
+            return self.login()
+        if route == 'index':
+            return self.client.get('/')
+        if route == 'add':
+            return self.client.post('/add', data={
+                'plant_name': f'Added {self.rng.randrange(10 ** 6)}',
+                'plant_species': 'Monstera',
+                'last_watered': datetime.now().strftime('%Y-%m-%d')
+            })
+        if route == 'forum':
+            return self.client.get('/forum')
+        if not self.plant_ids:
+            return None  # this worker's plants are used up; the request is not counted
+        if route == 'bulk_delete':
+            batch = [self.plant_ids.pop() for _ in range(min(BULK_DELETE_SIZE, len(self.plant_ids)))]
+            return self.client.post('/delete_selected_plants', data={'plant_ids': batch})
+        plant_id = self.rng.choice(self.plant_ids)
+        if route == 'water':
+            return self.client.post(f'/water/{plant_id}')
+        if route == 'detail':
+            return self.client.get(f'/plant/{plant_id}')
+        raise ValueError(f'Unknown route: {route}')
+
+
+def run_route(route, workers, counter, args):
+    """Sends args.requests requests to one route from args.concurrency threads."""
+    remaining = [args.requests]
+    remaining_lock = threading.Lock()
+    samples = []
+
+    def loop(worker):
+        local = []
+        while True:
+            with remaining_lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            counter.take()
+            start = time.perf_counter()
+            response = worker.request(route)
+            latency = time.perf_counter() - start
+            if response is None:
+                continue
+            local.append({'latency': latency, 'status': response.status_code,
+                          'round_trips': counter.take()})
+        return local
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for local in pool.map(loop, workers):
+            samples.extend(local)
+    return summarize(samples, time.perf_counter() - started)
+
+
+# --- Entry Point ---
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=10, help='seeded users')
+    parser.add_argument('--plants', type=int, default=20, help='seeded plants per user')
+    parser.add_argument('--events', type=int, default=20, help='seeded care events per plant')
+    parser.add_argument('--posts', type=int, default=200, help='seeded forum posts')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--routes', default=','.join(ROUTES),
+                        help=f'comma-separated subset of {",".join(ROUTES)}')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for data and requests')
+    parser.add_argument('--mongo-uri', default=os.getenv('MONGO_URI'), help='defaults to MONGO_URI')
+    parser.add_argument('--db-name', default=DEFAULT_DB_NAME, help='database to drop and seed')
+    parser.add_argument('--in-memory', action='store_true',
+                        help='start a throwaway mongod with pymongo_inmemory')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    args.routes = [r.strip() for r in args.routes.split(',') if r.strip()]
+    unknown = set(args.routes) - set(ROUTES)
+    if unknown:
+        parser.error(f'unknown routes: {", ".join(sorted(unknown))}')
+    if args.db_name == 'plant_watering_db':
+        parser.error('refusing to seed the application database; pick another --db-name')
+    if args.users < 1 or args.concurrency < 1:
+        parser.error('--users and --concurrency must be at least 1')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+
+    inmemory = None
+    if args.in_memory:
+        try:
+            from pymongo_inmemory import Mongod
+        except ImportError:
+            sys.exit('--in-memory needs pymongo_inmemory (pip install pymongo_inmemory).')
+        inmemory = Mongod()
+        inmemory.start()
+        args.mongo_uri = inmemory.connection_string
+
+    # The listener must be registered before app.py creates its MongoClient
+    counter = RoundTripCounter()
+    monitoring.register(counter)
+    if args.mongo_uri:
+        os.environ['MONGO_URI'] = args.mongo_uri
+    os.environ['MONGO_DB_NAME'] = args.db_name
+    os.environ['AUTO_CREATE_INDEXES'] = '0'
+    os.environ.setdefault('BUILD_IMAGES_ON_STARTUP', '0')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    try:
+        import app as app_module
+        app_module.app.config['TESTING'] = True
+
+        print('Seeding...', file=sys.stderr)
+        accounts = seed(app_module, args, rng)
+        workers = [Worker(app_module, *accounts[i % len(accounts)], random.Random(args.seed + i))
+                   for i in range(args.concurrency)]
+        for worker in workers:
+            worker.login()
+
+        routes = {}
+        for route in args.routes:
+            print(f'Running {route}...', file=sys.stderr)
+            routes[route] = run_route(route, workers, counter, args)
+
+        results = {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'care_events_storage': app_module.CARE_EVENTS_STORAGE,
+                'transactions': app_module.transactions_enabled,
+                'care_event_write_behind': app_module.CARE_EVENT_WRITE_BEHIND,
+            },
+            'config': {key: getattr(args, key) for key in (
+                'users', 'plants', 'events', 'posts', 'concurrency', 'requests', 'seed')},
+            'routes': routes,
+        }
+    finally:
+        if inmemory is not None:
+            inmemory.stop()
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
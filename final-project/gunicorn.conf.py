@@ -0,0 +1,52 @@
+# Production server settings: `gunicorn app:app` picks this file up from the
+# working directory. Every worker is a separate process with its own Mongo
+# client (created lazily after the fork) and its own threads, so the app scales
+# across all cores. Each setting can be overridden through the environment.
+import os
+import tempfile
+import multiprocessing
+
+cores = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5002')}"
+workers = int(os.getenv('WEB_CONCURRENCY', cores))
+worker_class = 'gthread'
+# Requests spend most of their time waiting on MongoDB, so a few threads per worker
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+
+# Imported once in the master and shared copy-on-write by the workers. Caches
+# are filled after the fork, so each worker has its own: the page cache (its
+# ETags come from MongoDB, so workers still agree on them), the user cache
+# (USER_CACHE_TTL bounds how long another worker's change takes to show) and
+# the care event write-behind queue, whose pending events and repeated-click
+# checks only cover the worker that took the click.
+preload_app = True
+# Recycle workers now and then so slow leaks cannot build up
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+
+# Per-worker defaults: one hashing process per worker already gives one per core,
+# and each worker needs at most a couple of Mongo connections per thread
+os.environ.setdefault('HASH_WORKERS', '1')
+os.environ.setdefault('MONGO_MAX_POOL_SIZE', str(threads * 2))
+
+# Request metrics are counted per worker; each writes its totals to METRICS_DIR
+# and /metrics adds them up, so a scrape sees the whole server (metrics.py)
+metrics_dir = os.getenv('METRICS_DIR') or tempfile.mkdtemp(prefix='plantcare-metrics-')
+os.environ['METRICS_DIR'] = metrics_dir
+
+def on_starting(server):
+    from metrics import clear_shared
+    os.makedirs(metrics_dir, exist_ok=True)
+    clear_shared(metrics_dir)
+
+def child_exit(server, worker):
+    # Recycled workers keep counting towards the totals
+    from metrics import mark_process_dead
+    mark_process_dead(metrics_dir, worker.pid)
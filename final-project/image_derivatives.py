@@ -0,0 +1,121 @@
+import os
+import json
+import hashlib
+from io import BytesIO
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow is only needed to build derivatives, not to serve them
+    Image = None
+
+# --- Derivative Settings ---
+DERIVATIVE_WIDTHS = (256, 512, 768)
+DERIVATIVE_FORMATS = ('avif', 'webp', 'png')
+DERIVED_DIR = 'images/derived'
+MANIFEST_NAME = 'manifest.json'
+
+MIME_TYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'png': 'image/png',
+}
+SAVE_OPTIONS = {
+    'avif': {'quality': 55},
+    'webp': {'quality': 80, 'method': 6},
+    'png': {'optimize': True},
+}
+
+
+def _supported_formats():
+    formats = []
+    for fmt in DERIVATIVE_FORMATS:
+        if fmt == 'png' or features.check(fmt):
+            formats.append(fmt)
+    return formats
+
+
+def _save_hashed(image, fmt, stem, width, out_dir):
+    """Encodes the image and writes it under a name containing its content hash."""
+    buffer = BytesIO()
+    image.save(buffer, format=fmt.upper(), **SAVE_OPTIONS[fmt])
+    data = buffer.getvalue()
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    filename = f"{stem}-{width}.{digest}.{fmt}"
+    path = os.path.join(out_dir, filename)
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(data)
+    return filename
+
+
+def build_derivatives(static_folder, image_paths):
+    """
+    Generates resized copies of every image in image_paths (relative to
+    static_folder) and writes a manifest mapping each original to its variants.
+    """
+    if Image is None:
+        raise RuntimeError('Pillow is required to build image derivatives.')
+
+    out_dir = os.path.join(static_folder, DERIVED_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    formats = _supported_formats()
+
+    manifest = {}
+    for image_path in sorted(set(image_paths)):
+        source = os.path.join(static_folder, image_path)
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        with Image.open(source) as original:
+            original = original.convert('RGB')
+            entry = {'width': original.width, 'sources': {}}
+            for fmt in formats:
+                variants = []
+                for width in DERIVATIVE_WIDTHS:
+                    if width > original.width:
+                        continue
+                    height = round(original.height * width / original.width)
+                    resized = original.resize((width, height), Image.LANCZOS)
+                    filename = _save_hashed(resized, fmt, stem, width, out_dir)
+                    variants.append({'width': width, 'path': f"{DERIVED_DIR}/{filename}"})
+                entry['sources'][fmt] = variants
+        manifest[image_path] = entry
+
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(static_folder):
+    """Returns the derivative manifest, or an empty dict if it has not been built."""
+    path = os.path.join(static_folder, DERIVED_DIR, MANIFEST_NAME)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def picture_sources(manifest, image_url, static_url):
+    """
+    Returns the <source> srcsets and fallback <img> data for image_url, or None
+    if it has no derivatives. static_url maps a static path to its URL.
+    """
+    entry = manifest.get(image_url)
+    if not entry:
+        return None
+
+    def srcset(variants):
+        return ', '.join(f"{static_url(v['path'])} {v['width']}w" for v in variants)
+
+    fallback = entry['sources'].get('png') or []
+    if not fallback:
+        return None
+    sources = [
+        {'type': MIME_TYPES[fmt], 'srcset': srcset(variants)}
+        for fmt, variants in entry['sources'].items()
+        if fmt != 'png' and variants
+    ]
+    return {
+        'sources': sources,
+        'src': static_url(fallback[0]['path']),
+        'srcset': srcset(fallback)
+    }
@@ -0,0 +1,368 @@
+import os
+import json
+import time
+import atexit
+import threading
+from glob import glob
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import request, g, before_render_template, template_rendered
+from pymongo import monitoring
+
+# --- Metric Settings ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COMMAND_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+SKIPPED_ENDPOINTS = {'metrics'}
+
+# The request being served by this thread (or task); pymongo reports commands
+# synchronously in the thread that sent them, so each one lands on its own request
+current_trace = ContextVar('current_trace', default=None)
+
+
+class RequestTrace:
+    """Everything measured during one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.commands = []
+        self.pending = {}
+        self.db_seconds = 0.0
+        self.documents = 0
+        self.render_seconds = 0.0
+        self.render_started = None
+        self.status = 500
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+    def to_list(self):
+        return [self.counts, self.total, self.sum]
+
+    def merge(self, data):
+        counts, total, total_sum = data
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.total += total
+        self.sum += total_sum
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.commands = Histogram(COMMAND_COUNT_BUCKETS)
+        self.statuses = {}
+        self.db_seconds = 0.0
+        self.documents = 0
+        self.render_seconds = 0.0
+
+    def to_dict(self):
+        return {'latency': self.latency.to_list(), 'commands': self.commands.to_list(),
+                'statuses': self.statuses, 'db_seconds': self.db_seconds,
+                'documents': self.documents, 'render_seconds': self.render_seconds}
+
+    def merge(self, data):
+        self.latency.merge(data['latency'])
+        self.commands.merge(data['commands'])
+        for status, count in data['statuses'].items():
+            self.statuses[int(status)] = self.statuses.get(int(status), 0) + count
+        self.db_seconds += data['db_seconds']
+        self.documents += data['documents']
+        self.render_seconds += data['render_seconds']
+
+
+# --- Sharing Between Processes ---
+# Under a pre-forking server every worker counts only its own requests, and a
+# scrape reaches just one of them. With a shared_dir each process writes its
+# totals to metrics-<pid>.json there, and render() adds up every file. Files of
+# exited workers are folded into metrics-dead.json by mark_process_dead(), so
+# the totals never go down.
+DEAD_WORKERS_FILE = 'metrics-dead.json'
+
+
+def process_file(shared_dir, pid):
+    return os.path.join(shared_dir, f'metrics-{pid}.json')
+
+
+@contextmanager
+def shared_lock(shared_dir, exclusive):
+    import fcntl  # only pre-forking servers share metrics, and those run on Unix
+    with open(os.path.join(shared_dir, '.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_snapshot(path, snapshot):
+    # Written aside and renamed, so a reader never sees half a file
+    directory, name = os.path.split(path)
+    temporary = os.path.join(directory, f'.{name}.tmp')
+    with open(temporary, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(temporary, path)
+
+
+def merge_snapshot(endpoints, snapshot):
+    for endpoint, data in snapshot.items():
+        stats = endpoints.get(endpoint)
+        if stats is None:
+            stats = endpoints[endpoint] = EndpointStats()
+        stats.merge(data)
+
+
+def load_shared(shared_dir):
+    endpoints = {}
+    with shared_lock(shared_dir, exclusive=False):
+        for path in glob(os.path.join(shared_dir, 'metrics-*.json')):
+            merge_snapshot(endpoints, read_snapshot(path))
+    return endpoints
+
+
+def mark_process_dead(shared_dir, pid):
+    """Folds the file of an exited worker into metrics-dead.json (gunicorn's child_exit hook)."""
+    path = process_file(shared_dir, pid)
+    with shared_lock(shared_dir, exclusive=True):
+        if not os.path.exists(path):
+            return
+        dead_path = os.path.join(shared_dir, DEAD_WORKERS_FILE)
+        endpoints = {}
+        merge_snapshot(endpoints, read_snapshot(dead_path))
+        merge_snapshot(endpoints, read_snapshot(path))
+        write_snapshot(dead_path, {endpoint: stats.to_dict() for endpoint, stats in endpoints.items()})
+        os.remove(path)
+
+
+def clear_shared(shared_dir):
+    """Removes the files of an earlier run, which would otherwise be added to this one."""
+    for path in glob(os.path.join(shared_dir, 'metrics-*.json')):
+        os.remove(path)
+
+
+def documents_in_reply(reply):
+    """Number of documents a find/aggregate/getMore reply carried back."""
+    cursor = reply.get('cursor') if isinstance(reply, dict) else None
+    if not isinstance(cursor, dict):
+        return 0
+    return len(cursor.get('firstBatch', cursor.get('nextBatch', ())))
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """Attributes every MongoDB command to the request that issued it."""
+
+    def started(self, event):
+        trace = current_trace.get()
+        if trace is not None:
+            collection = event.command.get(event.command_name)
+            trace.pending[event.request_id] = (
+                event.command_name, collection if isinstance(collection, str) else None
+            )
+
+    def succeeded(self, event):
+        self._finish(event, documents_in_reply(event.reply))
+
+    def failed(self, event):
+        self._finish(event, 0, failed=True)
+
+    def _finish(self, event, documents, failed=False):
+        trace = current_trace.get()
+        if trace is None:
+            return
+        name, collection = trace.pending.pop(event.request_id, (event.command_name, None))
+        seconds = event.duration_micros / 1e6
+        trace.db_seconds += seconds
+        trace.documents += documents
+        trace.commands.append((name, collection, seconds, documents, failed))
+
+
+class RequestMetrics:
+    """
+    Per-endpoint request metrics: latency histogram, MongoDB commands, time and
+    documents returned, and template render time, exposed in the Prometheus text
+    format by render(). Requests slower than slow_threshold seconds are logged
+    together with the commands they ran. Values are per process unless
+    shared_dir is set, in which case render() reports the totals of every
+    process writing to it (see Sharing Between Processes).
+    """
+
+    def __init__(self, app=None, slow_threshold=0.5, shared_dir=None, dump_interval=1.0):
+        self.listener = CommandRecorder()
+        self.slow_threshold = slow_threshold
+        self.shared_dir = shared_dir
+        self.dump_interval = dump_interval
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+        if shared_dir:
+            atexit.register(self.dump)
+        if app is not None:
+            self.init_app(app)
+
+    def _reset(self):
+        # Also runs in a forked child: it starts from zero with its own file and thread
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._dumper = None
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+
+    # --- Request Hooks ---
+
+    def _before_request(self):
+        g.request_trace = RequestTrace()
+        g.request_trace_token = current_trace.set(g.request_trace)
+
+    def _after_request(self, response):
+        trace = g.get('request_trace')
+        if trace is not None:
+            trace.status = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        trace = g.pop('request_trace', None)
+        if trace is None:
+            return
+        current_trace.reset(g.pop('request_trace_token'))
+        endpoint = request.endpoint or 'unmatched'
+        if endpoint in SKIPPED_ENDPOINTS:
+            return
+        elapsed = time.perf_counter() - trace.started
+        self.record(endpoint, elapsed, trace)
+        if elapsed >= self.slow_threshold:
+            self.log_slow_request(elapsed, trace)
+
+    def _before_render(self, sender, template, context, **extra):
+        trace = current_trace.get()
+        if trace is not None:
+            trace.render_started = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        trace = current_trace.get()
+        if trace is not None and trace.render_started is not None:
+            trace.render_seconds += time.perf_counter() - trace.render_started
+            trace.render_started = None
+
+    # --- Aggregation ---
+
+    def record(self, endpoint, elapsed, trace):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats()
+            stats.latency.observe(elapsed)
+            stats.commands.observe(len(trace.commands))
+            stats.statuses[trace.status] = stats.statuses.get(trace.status, 0) + 1
+            stats.db_seconds += trace.db_seconds
+            stats.documents += trace.documents
+            stats.render_seconds += trace.render_seconds
+            self._dirty = True
+            if self.shared_dir and self._dumper is None:
+                self._dumper = threading.Thread(target=self._dump_loop, name='metrics-dump', daemon=True)
+                self._dumper.start()
+
+    # --- Sharing ---
+
+    def _dump_loop(self):
+        while True:
+            time.sleep(self.dump_interval)
+            self.dump()
+
+    def dump(self):
+        """Writes this process's totals to its file in shared_dir, if anything changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = {endpoint: stats.to_dict() for endpoint, stats in self._endpoints.items()}
+            self._dirty = False
+        try:
+            write_snapshot(process_file(self.shared_dir, os.getpid()), snapshot)
+        except OSError as e:
+            print(f"Error writing metrics to {self.shared_dir}: {e}")
+
+    def log_slow_request(self, elapsed, trace):
+        commands = ', '.join(
+            f"{name}{'.' + collection if collection else ''} {seconds * 1000:.1f}ms"
+            f"{' FAILED' if failed else f' ({documents} docs)'}"
+            for name, collection, seconds, documents, failed in trace.commands
+        ) or 'none'
+        print(f"Slow request: {request.method} {request.full_path.rstrip('?')} -> {trace.status} "
+              f"in {elapsed * 1000:.0f}ms (db {trace.db_seconds * 1000:.0f}ms, "
+              f"render {trace.render_seconds * 1000:.0f}ms); commands: {commands}")
+
+    # --- Exposition ---
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        if self.shared_dir:
+            self.dump()
+            shared = load_shared(self.shared_dir)
+        with self._lock:
+            endpoints = sorted((shared if self.shared_dir else self._endpoints).items())
+            lines = []
+
+            def header(name, kind, text):
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+            def histogram(name, text, pick):
+                header(name, 'histogram', text)
+                for endpoint, stats in endpoints:
+                    hist = pick(stats)
+                    label = f'endpoint="{escape_label(endpoint)}"'
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{label},le="+Inf"}} {hist.total}')
+                    lines.append(f'{name}_sum{{{label}}} {hist.sum}')
+                    lines.append(f'{name}_count{{{label}}} {hist.total}')
+
+            def counter(name, text, pick):
+                header(name, 'counter', text)
+                for endpoint, stats in endpoints:
+                    lines.append(f'{name}{{endpoint="{escape_label(endpoint)}"}} {pick(stats)}')
+
+            histogram('http_request_duration_seconds', 'Request latency by Flask endpoint.',
+                      lambda s: s.latency)
+            header('http_requests_total', 'counter', 'Requests by Flask endpoint and status code.')
+            for endpoint, stats in endpoints:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f'http_requests_total{{endpoint="{escape_label(endpoint)}",'
+                                 f'status="{status}"}} {count}')
+            histogram('mongo_commands_per_request', 'MongoDB commands sent per request.',
+                      lambda s: s.commands)
+            counter('mongo_command_seconds_total', 'Time spent in MongoDB commands.',
+                    lambda s: s.db_seconds)
+            counter('mongo_documents_returned_total', 'Documents returned by MongoDB cursors.',
+                    lambda s: s.documents)
+            counter('template_render_seconds_total', 'Time spent rendering Jinja templates.',
+                    lambda s: s.render_seconds)
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,106 @@
+import os
+import threading
+from pymongo import MongoClient
+
+# MongoClient option -> (setting read from app.config or the environment, type).
+# Unset options keep the driver defaults.
+CLIENT_SETTINGS = {
+    'maxPoolSize': ('MONGO_MAX_POOL_SIZE', int),
+    'minPoolSize': ('MONGO_MIN_POOL_SIZE', int),
+    'maxIdleTimeMS': ('MONGO_MAX_IDLE_TIME_MS', int),
+    'waitQueueTimeoutMS': ('MONGO_WAIT_QUEUE_TIMEOUT_MS', int),
+    'connectTimeoutMS': ('MONGO_CONNECT_TIMEOUT_MS', int),
+    'serverSelectionTimeoutMS': ('MONGO_SERVER_SELECTION_TIMEOUT_MS', int),
+    'socketTimeoutMS': ('MONGO_SOCKET_TIMEOUT_MS', int),
+    'compressors': ('MONGO_COMPRESSORS', str),  # e.g. "zstd,zlib"
+}
+
+
+def client_options(config=None):
+    """Returns MongoClient keyword arguments for the MONGO_* settings that are set."""
+    options = {}
+    for option, (setting, cast) in CLIENT_SETTINGS.items():
+        value = (config or {}).get(setting) or os.getenv(setting)
+        if value not in (None, ''):
+            options[option] = cast(value)
+    return options
+
+
+class MongoConnection:
+    """
+    Creates the MongoClient on first use in each process instead of at import
+    time. A client must not be shared across fork(), so a pre-forking server
+    (gunicorn with preload_app) gets a fresh client and pool in every worker.
+    """
+
+    def __init__(self, app=None, **client_kwargs):
+        self._client_kwargs = client_kwargs
+        self._client = None
+        self._pid = None
+        self._collections = {}
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.uri = app.config.get('MONGO_URI') or os.getenv('MONGO_URI')
+        self.db_name = app.config.get('MONGO_DB_NAME') or os.getenv('MONGO_DB_NAME', 'plant_watering_db')
+        self.options = client_options(app.config)
+
+    def _after_fork(self):
+        # The parent's lock may have been held by another thread at fork time
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    # The parent's client is left alone; closing it here would touch its sockets
+                    self._collections = {}
+                    self._client = MongoClient(self.uri, **self.options, **self._client_kwargs)
+                    self._pid = os.getpid()
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.db_name]
+
+    def get_collection(self, name):
+        client = self.client
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = client[self.db_name][name]
+        return collection
+
+    def collection(self, name):
+        """Returns a stand-in for the named collection that is resolved on every use."""
+        return LazyCollection(self, name)
+
+    def close(self):
+        if self._client is not None and self._pid == os.getpid():
+            self._client.close()
+        self._client = None
+        self._collections = {}
+
+
+class LazyCollection:
+    """Forwards every attribute to the current process's pymongo Collection."""
+
+    __slots__ = ('_mongo', '_name')
+
+    def __init__(self, mongo, name):
+        self._mongo = mongo
+        self._name = name
+
+    @property
+    def name(self):
+        return self._name
+
+    def __getattr__(self, attr):
+        return getattr(self._mongo.get_collection(self._name), attr)
+
+    def __repr__(self):
+        return f"LazyCollection({self._name!r})"
@@ -0,0 +1,80 @@
+import time
+import hmac
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class LRUBackend:
+    """
+    In-process storage for PageCache. Any object with the same get/set/delete
+    methods (e.g. a thin Redis wrapper) can be used instead, which also shares
+    rendered pages between worker processes. Entries expire after ttl seconds.
+    """
+
+    def __init__(self, maxsize=512, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class PageCache:
+    """
+    Caches rendered pages per namespace (e.g. 'forum' or 'plant:<id>') under a
+    validator: a token read from MongoDB that changes whenever the data behind
+    the page does (a document version, the newest id). Every worker process
+    reads the same validator, so ETags agree between processes and a stored
+    page is never served after its data has changed; superseded entries simply
+    age out of the backend. Callers read the validator before rendering, so a
+    page is never stored under a validator newer than its data.
+    """
+
+    def __init__(self, secret_key, backend=None):
+        self.backend = backend if backend is not None else LRUBackend()
+        self._secret = secret_key.encode() if isinstance(secret_key, str) else secret_key
+        self.hits = 0
+        self.misses = 0
+
+    def page_key(self, namespace, validator, variant):
+        return f"page:{namespace}:{validator}:{variant}"
+
+    def etag(self, namespace, validator, variant):
+        # Keyed with the app secret so clients cannot compute ETags for pages they never saw
+        key = self.page_key(namespace, validator, variant).encode()
+        return hmac.new(self._secret, key, hashlib.sha256).hexdigest()[:32]
+
+    def get(self, namespace, validator, variant):
+        body = self.backend.get(self.page_key(namespace, validator, variant))
+        if body is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return body
+
+    def set(self, namespace, validator, variant, body):
+        self.backend.set(self.page_key(namespace, validator, variant), body)
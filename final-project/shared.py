@@ -0,0 +1,913 @@
+"""
+Helpers and constants shared by app.py (Flask) and asgi_app.py (Quart): queries,
+update pipelines, page tokens, parsing and formatting. Importing this module
+has no side effects beyond loading .env: it opens no database connection and
+builds nothing, so either app can import it without pulling in the other.
+"""
+import io
+import os
+import re
+import csv
+import json
+import hashlib
+import time
+import zlib
+import base64
+import threading
+import multiprocessing
+from itertools import groupby
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pymongo import DESCENDING, UpdateOne
+from bson.objectid import ObjectId
+from datetime import datetime, timedelta, timezone
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+from flask_login import UserMixin
+from markupsafe import Markup, escape
+from dotenv import load_dotenv
+from image_derivatives import build_derivatives, load_manifest
+from static_assets import build_assets, load_manifest as load_asset_manifest
+
+# --- Load Environment Variables ---
+# Loaded here, since the settings below are read when this module is imported
+load_dotenv()
+
+def parse_object_ids(values):
+    """Converts submitted id strings to ObjectIds, skipping malformed ones."""
+    return [ObjectId(value) for value in values if ObjectId.is_valid(value)]
+
+# --- Pagination Helpers ---
+FORUM_PAGE_SIZE = 20
+FORUM_EXCERPT_LENGTH = 280
+FORUM_LIST_PROJECTION = {
+    'title': 1,
+    'username': 1,
+    'created_at': 1,
+    'excerpt': {'$substrCP': ['$content', 0, FORUM_EXCERPT_LENGTH]},
+    'content_length': {'$strLenCP': '$content'},
+    'reply_count': 1,
+    'latest_replies': 1
+}
+
+def encode_cursor(sort_value, doc_id):
+    """Builds an opaque page token from the last document of a page."""
+    raw = f"{sort_value.isoformat()}|{doc_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(token):
+    """Returns (sort_value, ObjectId) or raises ValueError for a bad token."""
+    try:
+        raw = base64.urlsafe_b64decode(token.encode()).decode()
+        sort_value, doc_id = raw.split('|', 1)
+        return datetime.fromisoformat(sort_value), ObjectId(doc_id)
+    except Exception as e:
+        raise ValueError(f"Invalid page token: {token}") from e
+
+def keyset_filter(field, cursor, direction=DESCENDING):
+    """Matches documents strictly after the cursor in (field, _id) order."""
+    sort_value, doc_id = cursor
+    op = '$lt' if direction == DESCENDING else '$gt'
+    return {'$or': [
+        {field: {op: sort_value}},
+        {field: sort_value, '_id': {op: doc_id}}
+    ]}
+
+# --- Document Versions ---
+# Plants and forum posts carry a 'version' counter that every write bumps (a
+# missing field counts as 0). The JSON API derives its ETags from it.
+VERSION_INC = {'version': 1}  # for $inc in operator updates
+VERSION_BUMP = {'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]}}  # for $set in pipelines
+
+# --- Care Stats ---
+# Each plant carries a running summary of its watering history in 'care_stats',
+# updated in the same write that records a watering, so the detail page never
+# has to scan care_events to show it.
+HISTORY_PAGE_SIZE = 25
+
+def initial_care_stats(event_date):
+    return {
+        'total_waterings': 1,
+        'first_event': event_date,
+        'last_event': event_date,
+        'longest_gap_seconds': 0
+    }
+
+def care_stats_update(event_date):
+    """Update pipeline that records a watering at event_date on a plant document."""
+    return [{'$set': {
+        **VERSION_BUMP,
+        'last_watered': event_date,
+        'next_due': {'$add': [event_date, {'$multiply': [
+            {'$ifNull': ['$watering_interval_days', DEFAULT_WATERING_INTERVAL_DAYS]}, MS_PER_DAY
+        ]}]},
+        'care_stats.total_waterings': {'$add': [{'$ifNull': ['$care_stats.total_waterings', 0]}, 1]},
+        'care_stats.first_event': {'$min': ['$care_stats.first_event', event_date]},
+        'care_stats.last_event': {'$max': ['$care_stats.last_event', event_date]},
+        'care_stats.longest_gap_seconds': {'$max': [
+            {'$ifNull': ['$care_stats.longest_gap_seconds', 0]},
+            {'$divide': [{'$subtract': [event_date, '$care_stats.last_event']}, 1000]}
+        ]}
+    }}]
+
+def care_stats_summary(plant):
+    """Turns the stored counters into the numbers shown on the detail page."""
+    stats = plant.get('care_stats')
+    if not stats:
+        return None
+    total = stats.get('total_waterings', 0)
+    average_days = None
+    if total > 1:
+        span = stats['last_event'] - stats['first_event']
+        average_days = span.total_seconds() / 86400 / (total - 1)
+    return {
+        'total_waterings': total,
+        'average_interval_days': average_days,
+        'longest_gap_days': stats.get('longest_gap_seconds', 0) / 86400
+    }
+
+# --- Care Event Storage ---
+# 'documents' stores one care_events document per event. 'buckets' groups the
+# events of a plant into per-month documents in care_event_buckets (at most
+# BUCKET_MAX_EVENTS each), which keeps the collection and its index far smaller.
+CARE_EVENTS_STORAGE = os.getenv('CARE_EVENTS_STORAGE', 'documents')
+BUCKET_MAX_EVENTS = 200
+
+def month_start(date):
+    return datetime(date.year, date.month, 1)
+
+def bucket_upsert(event):
+    """UpdateOne that appends an event to its plant's bucket for that month."""
+    return UpdateOne(
+        {
+            'plant_id': event['plant_id'],
+            'user_id': event['user_id'],
+            'month': month_start(event['event_date']),
+            'count': {'$lt': BUCKET_MAX_EVENTS}
+        },
+        {
+            '$push': {'events': {k: v for k, v in event.items() if k not in ('plant_id', 'user_id')}},
+            '$inc': {'count': 1}
+        },
+        upsert=True
+    )
+
+# --- Species Catalog ---
+SPECIES_CATALOG = {
+    'Monstera': {'image': 'images/monstera.png', 'watering_interval_days': 7},
+    'Pothos': {'image': 'images/pothos.png', 'watering_interval_days': 7},
+    'Succulent': {'image': 'images/suculenta.png', 'watering_interval_days': 14},
+    'Snake Plant': {'image': 'images/sansevieria.png', 'watering_interval_days': 21},
+}
+SPECIES_IMAGES = {name: info['image'] for name, info in SPECIES_CATALOG.items()}
+DEFAULT_IMAGE = 'images/default.png'
+DEFAULT_WATERING_INTERVAL_DAYS = 7
+MS_PER_DAY = 24 * 3600 * 1000
+
+def watering_interval(species):
+    return SPECIES_CATALOG.get(species, {}).get('watering_interval_days', DEFAULT_WATERING_INTERVAL_DAYS)
+
+def next_due_date(last_watered, species):
+    return last_watered + timedelta(days=watering_interval(species))
+
+# --- Image Derivatives ---
+# Resized AVIF/WebP/PNG copies of the species images, built once and listed in
+# a manifest. Templates fall back to the original PNG when it has not been built.
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600
+
+def build_image_manifest(static_folder):
+    return build_derivatives(static_folder, list(SPECIES_IMAGES.values()) + [DEFAULT_IMAGE])
+
+def startup_image_manifest(static_folder):
+    """The image manifest, built first if it is missing and BUILD_IMAGES_ON_STARTUP allows it."""
+    manifest = load_manifest(static_folder)
+    if not manifest and os.getenv('BUILD_IMAGES_ON_STARTUP', '1') == '1':
+        try:
+            manifest = build_image_manifest(static_folder)
+        except (RuntimeError, OSError) as e:
+            print(f"Error building image derivatives: {e}")
+    return manifest
+
+# --- Static Assets ---
+def startup_asset_manifest(static_folder):
+    """
+    The static asset manifest, rebuilt unless BUILD_ASSETS_ON_STARTUP=0 so the
+    hashes always match the files being deployed; unchanged files are not copied again.
+    """
+    if os.getenv('BUILD_ASSETS_ON_STARTUP', '1') == '1':
+        try:
+            return build_assets(static_folder)
+        except OSError as e:
+            print(f"Error building static assets: {e}")
+    return load_asset_manifest(static_folder)
+
+# --- Password Hashing ---
+# Hashing is deliberately slow, so it runs on a small process pool instead of the
+# request thread (and outside the GIL). At most HASH_QUEUE_LIMIT jobs may be queued
+# or running; past that, logins are refused with a 503 rather than piling up.
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', os.cpu_count() or 1))
+HASH_QUEUE_LIMIT = int(os.getenv('HASH_QUEUE_LIMIT', HASH_WORKERS * 4))
+HASH_TIMEOUT = float(os.getenv('HASH_TIMEOUT', 10))
+
+HASH_MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+# Templates re-rendered with a 503 when hashing is overloaded, by endpoint
+HASHING_FORM_TEMPLATES = {'register': 'register.html', 'login': 'login.html'}
+
+class HashingOverloaded(Exception):
+    pass
+
+hash_slots = threading.BoundedSemaphore(HASH_QUEUE_LIMIT)
+hash_executor = None
+hash_executor_pid = None
+hash_executor_lock = threading.Lock()
+
+def get_hash_executor():
+    # Created lazily and per process, so a forked worker never inherits the parent's pool
+    global hash_executor, hash_executor_pid
+    with hash_executor_lock:
+        if hash_executor is None or hash_executor_pid != os.getpid():
+            # Forking a multi-threaded worker can copy locks held by other threads into
+            # the child, so pool processes come from a clean forkserver (or spawn)
+            hash_executor = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=HASH_MP_CONTEXT)
+            hash_executor_pid = os.getpid()
+        return hash_executor
+
+def discard_hash_executor(executor):
+    """Drops a pool broken by a dead process (OOM kill, crash), so the next job starts a new one."""
+    global hash_executor
+    with hash_executor_lock:
+        if hash_executor is executor:
+            hash_executor = None
+    executor.shutdown(wait=False)
+
+def submit_hash_job(executor, fn, *args):
+    """Queues fn(*args) on executor and returns its Future, or raises HashingOverloaded."""
+    if not hash_slots.acquire(blocking=False):
+        raise HashingOverloaded()
+    try:
+        future = executor.submit(fn, *args)
+    except Exception:
+        hash_slots.release()
+        raise
+    future.add_done_callback(lambda _: hash_slots.release())
+    return future
+
+def hash_method_prefix():
+    """
+    The method prefix Werkzeug stores for PASSWORD_HASH_METHOD. Shorthands are
+    expanded when hashing ('scrypt' is stored as 'scrypt:32768:8:1'), so they
+    are expanded here the same way instead of comparing the configured string.
+    """
+    method, *args = PASSWORD_HASH_METHOD.split(':')
+    if method == 'scrypt':
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f"scrypt:{n}:{r}:{p}"
+    if method == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    return PASSWORD_HASH_METHOD
+
+def needs_rehash(password_hash):
+    """True if the hash was made with different parameters than PASSWORD_HASH_METHOD."""
+    return password_hash.split('$', 1)[0] != hash_method_prefix()
+
+# --- Users ---
+class User(UserMixin):
+    def __init__(self, user_data):
+        self.id = str(user_data['_id'])
+        self.username = user_data['username']
+        self.email = user_data['email']
+        self.password_hash = user_data['password_hash']
+
+class UserCache:
+    """
+    Bounded in-process cache of User objects keyed by id. Entries expire after
+    ttl seconds and the least recently used entry is evicted once maxsize is reached.
+    """
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user):
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        """Call whenever a user's account data changes or the account is removed."""
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+# --- Dashboard Filters ---
+PLANTS_PAGE_SIZE = 24
+
+def parse_date_arg(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+def parse_plant_filters(args):
+    """Reads the dashboard filters from the query string, dropping invalid values."""
+    try:
+        page = max(1, int(args.get('page', 1)))
+    except ValueError:
+        page = 1
+    return {
+        'species': args.get('species', '').strip(),
+        'q': args.get('q', '').strip(),
+        'watered_after': args.get('watered_after', '') if parse_date_arg(args.get('watered_after')) else '',
+        'watered_before': args.get('watered_before', '') if parse_date_arg(args.get('watered_before')) else '',
+        'page': page
+    }
+
+def plant_filter_query(owner_id, filters):
+    """The dashboard filters other than species, as a query on the user's plants."""
+    match = {'user_id': owner_id}
+    if filters['q']:
+        match['name_lower'] = {'$regex': '^' + re.escape(filters['q'].lower())}
+    watered = {}
+    if filters['watered_after']:
+        watered['$gte'] = parse_date_arg(filters['watered_after'])
+    if filters['watered_before']:
+        watered['$lt'] = parse_date_arg(filters['watered_before']) + timedelta(days=1)
+    if watered:
+        match['last_watered'] = watered
+    return match
+
+def plant_page_query(owner_id, filters):
+    query = plant_filter_query(owner_id, filters)
+    if filters['species']:
+        query['species'] = filters['species']
+    return query
+
+# Served by the user_created_at_id index; $facet sub-pipelines cannot use indexes,
+# so the page is read with find() and the aggregation below only counts. _id
+# breaks ties, since a bulk import gives all its plants the same created_at.
+PLANT_PAGE_SORT = [('created_at', DESCENDING), ('_id', DESCENDING)]
+
+def plant_page_skip(filters):
+    return (filters['page'] - 1) * PLANTS_PAGE_SIZE
+
+def plant_facet_pipeline(owner_id, filters):
+    """
+    One aggregation returning the species counts and the filtered total.
+    Filters other than species go in the leading $match (served by the user_*
+    indexes); species counts ignore the species filter so every option stays visible.
+    """
+    species_match = {'species': filters['species']} if filters['species'] else {}
+    return [
+        {'$match': plant_filter_query(owner_id, filters)},
+        {'$facet': {
+            'species': [
+                {'$group': {'_id': '$species', 'count': {'$sum': 1}}},
+                {'$sort': {'_id': 1}}
+            ],
+            'total': [
+                {'$match': species_match},
+                {'$count': 'count'}
+            ]
+        }}
+    ]
+
+def unpack_plant_facets(result, plants, filters):
+    facets = result[0] if result else {'species': [], 'total': []}
+    total = facets['total'][0]['count'] if facets['total'] else 0
+    return {
+        'plants': plants,
+        'species_facets': [{'name': f['_id'], 'count': f['count']} for f in facets['species']],
+        'total': total,
+        'has_next': filters['page'] * PLANTS_PAGE_SIZE < total,
+        'filters': filters,
+        'filters_active': any(filters[k] for k in ('species', 'q', 'watered_after', 'watered_before'))
+    }
+
+# --- Export ---
+EXPORT_BATCH_SIZE = 500
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+PLANT_EXPORT_FIELDS = ('id', 'name', 'species', 'last_watered', 'next_due',
+                       'watering_interval_days', 'total_waterings', 'created_at')
+CARE_EVENT_EXPORT_FIELDS = ('plant_id', 'plant_name', 'event_id', 'event_type', 'event_date', 'notes')
+
+def export_value(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+PLANT_EXPORT_PROJECTION = {
+    'name': 1, 'species': 1, 'last_watered': 1, 'next_due': 1,
+    'watering_interval_days': 1, 'care_stats.total_waterings': 1, 'created_at': 1
+}
+
+def export_query(owner_id, plant_id=None):
+    query = {'user_id': owner_id}
+    if plant_id:
+        query['_id'] = plant_id
+    return query
+
+def plant_export_row(plant):
+    return {
+        'id': plant['_id'],
+        'name': plant['name'],
+        'species': plant['species'],
+        'last_watered': plant.get('last_watered'),
+        'next_due': plant.get('next_due'),
+        'watering_interval_days': plant.get('watering_interval_days'),
+        'total_waterings': plant.get('care_stats', {}).get('total_waterings'),
+        'created_at': plant.get('created_at')
+    }
+
+def care_event_export_row(plant, event):
+    return {
+        'plant_id': plant['_id'],
+        'plant_name': plant['name'],
+        'event_id': event['_id'],
+        'event_type': event.get('event_type'),
+        'event_date': event.get('event_date'),
+        'notes': event.get('notes', '')
+    }
+
+class ExportEncoder:
+    """Writes export rows as CSV or NDJSON text and hands it out in chunks."""
+
+    def __init__(self, fmt, fields):
+        self.fields = fields
+        self.buffer = io.StringIO()
+        self.writer = None
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(self.buffer, fieldnames=fields)
+            self.writer.writeheader()
+
+    def write(self, row):
+        """Adds a row; returns a chunk once about EXPORT_CHUNK_SIZE characters are buffered."""
+        if self.writer:
+            self.writer.writerow({field: export_value(row[field]) for field in self.fields})
+        else:
+            self.buffer.write(json.dumps(row, default=export_value) + '\n')
+        if self.buffer.tell() >= EXPORT_CHUNK_SIZE:
+            return self.take()
+        return None
+
+    def take(self):
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return text
+
+def gzip_compressor():
+    return zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+
+def export_headers(dataset, fmt, gzip):
+    headers = {
+        'Content-Type': f'{EXPORT_MIMETYPES[fmt]}; charset=utf-8',
+        'Content-Disposition': f'attachment; filename="{dataset}-{datetime.now():%Y%m%d}.{fmt}"',
+        'Cache-Control': 'no-store',
+        'Vary': 'Accept-Encoding'
+    }
+    if gzip:
+        headers['Content-Encoding'] = 'gzip'
+    return headers
+
+# --- Bulk Import ---
+# Plants (with optional watering history) are imported from CSV or NDJSON.
+# Rows are read one at a time from the file stream and written in chunks of
+# IMPORT_CHUNK_SIZE plants with unordered bulk inserts, so one bad row never
+# blocks the rest and the file is never held in memory. Columns / keys:
+#   name, species, last_watered, watering_history (';'-separated dates in CSV,
+#   a list or the same string in NDJSON). Dates are ISO 8601.
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_FORMATS = ('csv', 'ndjson')
+IMPORT_ERROR_LIMIT = 100  # errors kept for the report; all of them are counted
+IMPORT_NAME_MAX_LENGTH = 100
+SPECIES_BY_LOWER = {name.lower(): name for name in SPECIES_IMAGES}
+
+def import_format(filename, default='csv'):
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    if extension in ('ndjson', 'jsonl'):
+        return 'ndjson'
+    return extension if extension in IMPORT_FORMATS else default
+
+def read_import_rows(stream, fmt):
+    """Yields (line_number, row) from a text stream; NDJSON rows are left unparsed."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(stream, start=1):
+            if line.strip():
+                yield line_number, line
+
+def parse_import_date(value):
+    try:
+        parsed = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ValueError(f'Invalid date "{value}", expected YYYY-MM-DD.')
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def parse_import_row(row):
+    """Validates one row and returns (name, species, waterings), or raises ValueError."""
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except ValueError:
+            raise ValueError('Invalid JSON.')
+    if not isinstance(row, dict):
+        raise ValueError('Expected an object with name, species and last_watered.')
+
+    name = str(row.get('name') or '').strip()
+    if not name:
+        raise ValueError('Missing plant name.')
+    if len(name) > IMPORT_NAME_MAX_LENGTH:
+        raise ValueError(f'Plant name is longer than {IMPORT_NAME_MAX_LENGTH} characters.')
+
+    species = str(row.get('species') or '').strip()
+    if not species:
+        raise ValueError('Missing species.')
+    species = SPECIES_BY_LOWER.get(species.lower(), species)
+
+    history = row.get('watering_history') or []
+    if isinstance(history, str):
+        history = history.split(';')
+    if not isinstance(history, list):
+        raise ValueError('watering_history must be a list of dates.')
+    waterings = [parse_import_date(value) for value in history if str(value).strip()]
+    if row.get('last_watered'):
+        waterings.append(parse_import_date(row['last_watered']))
+    if not waterings:
+        raise ValueError('Missing last_watered date.')
+    return name, species, sorted(set(waterings))
+
+def build_imported_plant(owner_id, name, species, waterings, now):
+    """Returns the plant document and its care events, with care_stats already filled in."""
+    plant_id = ObjectId()
+    stats = initial_care_stats(waterings[0])
+    stats['total_waterings'] = len(waterings)
+    stats['last_event'] = waterings[-1]
+    stats['longest_gap_seconds'] = max(
+        ((later - earlier).total_seconds() for earlier, later in zip(waterings, waterings[1:])),
+        default=0
+    )
+    plant = {
+        '_id': plant_id,
+        'name': name,
+        'name_lower': name.lower(),
+        'species': species,
+        'last_watered': waterings[-1],
+        'image_url': SPECIES_IMAGES.get(species, DEFAULT_IMAGE),
+        'created_at': now,
+        'user_id': owner_id,
+        'care_stats': stats,
+        'watering_interval_days': watering_interval(species),
+        'next_due': next_due_date(waterings[-1], species)
+    }
+    events = [{
+        '_id': ObjectId(),
+        'plant_id': plant_id,
+        'user_id': owner_id,
+        'event_type': 'water',
+        'event_date': date,
+        'notes': 'Imported.'
+    } for date in waterings]
+    return plant, events
+
+def new_import_summary():
+    return {'rows': 0, 'plants': 0, 'events': 0, 'error_count': 0, 'errors': []}
+
+def report_import_error(summary, line_number, message):
+    summary['error_count'] += 1
+    if len(summary['errors']) < IMPORT_ERROR_LIMIT:
+        summary['errors'].append({'line': line_number, 'message': message})
+
+def import_chunks(rows, owner_id, summary, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Parses (line_number, row) pairs and yields lists of up to chunk_size
+    (line_number, plant, events) tuples, counting rows and bad rows in summary.
+    """
+    chunk = []
+    now = datetime.now()
+    line_number = None
+    try:
+        for line_number, row in rows:
+            summary['rows'] += 1
+            try:
+                name, species, waterings = parse_import_row(row)
+            except ValueError as e:
+                report_import_error(summary, line_number, str(e))
+                continue
+            plant, events = build_imported_plant(owner_id, name, species, waterings, now)
+            chunk.append((line_number, plant, events))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    except (UnicodeDecodeError, csv.Error) as e:
+        # The rest of the file cannot be read; keep what was parsed so far
+        report_import_error(summary, line_number, f'Could not read the file: {e}')
+    if chunk:
+        yield chunk
+
+def failed_import_plants(summary, chunk, error):
+    """Reports the plants of chunk rejected by an unordered insert_many and returns their ids."""
+    failed = set()
+    for write_error in error.details.get('writeErrors', []):
+        line_number, plant, _ = chunk[write_error['index']]
+        failed.add(plant['_id'])
+        report_import_error(summary, line_number,
+                            f"Could not save plant: {write_error.get('errmsg', 'write error')}")
+    return failed
+
+def imported_events(chunk, failed):
+    return [event for _, plant, plant_events in chunk if plant['_id'] not in failed
+            for event in plant_events]
+
+def imported_event_documents(events):
+    """
+    The documents to insert for care events of freshly imported plants. In
+    bucket storage the month buckets are built here and inserted directly,
+    since none of them can exist yet. events must be grouped by plant, in date order.
+    """
+    if CARE_EVENTS_STORAGE != 'buckets':
+        return events
+
+    buckets = []
+    for (plant_id, month), month_events in groupby(
+            events, key=lambda e: (e['plant_id'], month_start(e['event_date']))):
+        month_events = list(month_events)
+        for start in range(0, len(month_events), BUCKET_MAX_EVENTS):
+            part = month_events[start:start + BUCKET_MAX_EVENTS]
+            buckets.append({
+                'plant_id': plant_id,
+                'user_id': part[0]['user_id'],
+                'month': month,
+                'count': len(part),
+                'events': [{k: v for k, v in e.items() if k not in ('plant_id', 'user_id')} for e in part]
+            })
+    return buckets
+
+def lost_imported_events(summary, chunk, documents, error):
+    """Reports the event documents rejected by an unordered insert_many and returns how many events they held."""
+    lines = {plant['_id']: line_number for line_number, plant, _ in chunk}
+    lost = 0
+    for write_error in error.details.get('writeErrors', []):
+        document = documents[write_error['index']]
+        lost += len(document.get('events', [document]))
+        report_import_error(summary, lines[document['plant_id']], 'Could not save part of the watering history.')
+    return lost
+
+# --- Watering Schedule ---
+DUE_SOON_LIMIT = 200
+
+def due_plants_query(as_of, user_id=None):
+    query = {'next_due': {'$lte': as_of}}
+    if user_id is not None:
+        query['user_id'] = user_id
+    return query
+
+def serialize_due_plant(plant):
+    return {
+        'id': str(plant['_id']),
+        'name': plant['name'],
+        'species': plant['species'],
+        'last_watered': plant['last_watered'].isoformat(),
+        'next_due': plant['next_due'].isoformat()
+    }
+
+def parse_days_ahead(value):
+    try:
+        return max(0, min(int(value), 365))
+    except (TypeError, ValueError):
+        return 1
+
+# --- Forum ---
+# The site_versions document holding the forum list's version counter
+FORUM_VERSION_KEY = {'_id': 'forum'}
+
+# --- Forum Replies ---
+# Replies live in forum_replies, read a page at a time in the thread view. Each
+# post also carries reply_count and its FORUM_REPLY_PREVIEWS latest replies
+# (trimmed by $slice), so the forum list renders previews from the posts alone.
+FORUM_REPLY_PREVIEWS = 3
+FORUM_REPLY_PREVIEW_LENGTH = 200
+FORUM_REPLY_PAGE_SIZE = 50
+FORUM_POST_PROJECTION = {'user_id': 1, 'username': 1, 'title': 1, 'content': 1,
+                         'created_at': 1, 'reply_count': 1}
+
+def reply_preview(reply):
+    return {
+        '_id': reply['_id'],
+        'username': reply['username'],
+        'created_at': reply['created_at'],
+        'excerpt': reply['content'][:FORUM_REPLY_PREVIEW_LENGTH],
+        'truncated': len(reply['content']) > FORUM_REPLY_PREVIEW_LENGTH
+    }
+
+def add_reply_update(reply):
+    """Counts the reply and keeps only the latest previews embedded in the post."""
+    return {
+        '$inc': {'reply_count': 1, **VERSION_INC},
+        '$set': {'last_reply_at': reply['created_at']},
+        '$push': {'latest_replies': {'$each': [reply_preview(reply)],
+                                     '$slice': -FORUM_REPLY_PREVIEWS}}
+    }
+
+def parse_post_id(post_id):
+    return ObjectId(post_id) if ObjectId.is_valid(post_id) else None
+
+# --- Forum Search ---
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGES = 10
+SEARCH_SNIPPET_LENGTH = 240
+FORUM_SEARCH_PROJECTION = {
+    'title': 1,
+    'username': 1,
+    'created_at': 1,
+    'content': 1,
+    'score': {'$meta': 'textScore'}
+}
+
+def search_terms(query):
+    """Words to highlight: quoted phrases are split and negated terms are dropped."""
+    return [word for word in re.findall(r'-?\w+', query) if not word.startswith('-')]
+
+def term_pattern(terms):
+    # Prefix match so 'water' also highlights 'watering', close to what stemming matched
+    alternatives = '|'.join(re.escape(t) for t in sorted(set(terms), key=len, reverse=True))
+    return re.compile(rf'\b(?:{alternatives})\w*', re.IGNORECASE)
+
+def highlight(text, pattern):
+    parts = []
+    last = 0
+    for match in pattern.finditer(text):
+        parts.append(escape(text[last:match.start()]))
+        parts.append(Markup('<mark>%s</mark>') % match.group())
+        last = match.end()
+    parts.append(escape(text[last:]))
+    return Markup('').join(parts)
+
+def search_snippet(content, pattern, width=SEARCH_SNIPPET_LENGTH):
+    """A window of content around the first match, with every match highlighted."""
+    match = pattern.search(content)
+    start = max(0, match.start() - width // 3) if match else 0
+    end = min(len(content), start + width)
+    snippet = highlight(content[start:end], pattern)
+    if start > 0:
+        snippet = Markup('&hellip;') + snippet
+    if end < len(content):
+        snippet = snippet + Markup('&hellip;')
+    return snippet
+
+def parse_search_page(value):
+    try:
+        return max(1, min(int(value), SEARCH_MAX_PAGES))
+    except (TypeError, ValueError):
+        return 1
+
+def format_search_results(posts, terms):
+    pattern = term_pattern(terms) if terms else None
+    for post in posts:
+        content = post.pop('content', '')
+        post['title_html'] = highlight(post['title'], pattern) if pattern else escape(post['title'])
+        post['snippet'] = search_snippet(content, pattern) if pattern else escape(content[:SEARCH_SNIPPET_LENGTH])
+    return posts
+
+# --- JSON API ---
+# Versioned read API for the mobile client over plants, care events and forum
+# posts. Every response has a strong ETag built from the versions of the
+# documents in it; when the client already has it, the answer is a 304 after a
+# query that reads nothing but those versions.
+try:
+    import orjson
+except ImportError:  # the standard library encoder is used instead
+    orjson = None
+
+API_PREFIX = '/api/v1'
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+API_MAX_IDS = 100
+PLANT_API_FIELDS = ('name', 'species', 'image_url', 'last_watered', 'next_due',
+                    'watering_interval_days', 'care_stats', 'archived_events', 'created_at')
+CARE_EVENT_API_FIELDS = ('event_type', 'event_date', 'notes')
+FORUM_POST_API_FIELDS = ('username', 'title', 'content', 'created_at', 'reply_count', 'latest_replies')
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def api_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def dump_json(payload):
+    """Encodes an API payload to bytes; ObjectIds become strings and datetimes ISO 8601."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=api_default)
+    return json.dumps(payload, default=api_default, separators=(',', ':')).encode('utf-8')
+
+def api_object_id(value, what):
+    if not ObjectId.is_valid(value):
+        raise ApiError(404, f'{what} not found.')
+    return ObjectId(value)
+
+def api_fields(args, allowed):
+    """Fields picked with ?fields=a,b (default: all of allowed)."""
+    if not args.get('fields'):
+        return allowed
+    fields = tuple(dict.fromkeys(f.strip() for f in args['fields'].split(',') if f.strip()))
+    unknown = set(fields) - set(allowed)
+    if unknown:
+        raise ApiError(400, f"Unknown fields: {', '.join(sorted(unknown))}.")
+    return fields
+
+def api_ids(args):
+    """Ids requested with ?ids=a,b,c, in order and without repeats."""
+    values = [v.strip() for v in args.get('ids', '').split(',') if v.strip()]
+    if len(values) > API_MAX_IDS:
+        raise ApiError(400, f'At most {API_MAX_IDS} ids per request.')
+    ids = parse_object_ids(values)
+    if len(ids) != len(values):
+        raise ApiError(400, 'Invalid id.')
+    return list(dict.fromkeys(ids))
+
+def api_page_size(args):
+    try:
+        return max(1, min(int(args.get('limit', API_PAGE_SIZE)), API_MAX_PAGE_SIZE))
+    except ValueError:
+        raise ApiError(400, 'limit must be an integer.')
+
+def api_cursor(args):
+    if not args.get('after'):
+        return None
+    try:
+        return decode_cursor(args['after'])
+    except ValueError:
+        raise ApiError(400, 'Invalid page token.')
+
+def api_projection(fields, *extra):
+    return {field: 1 for field in ('version', *fields, *extra)}
+
+def api_document(doc, fields):
+    return {'id': doc['_id'], **{field: doc.get(field) for field in fields}}
+
+def document_versions(docs):
+    return [(doc['_id'], doc.get('version', 0)) for doc in docs]
+
+def api_etag(user_id, full_path, versions):
+    """Strong ETag over the user, the URL and the (id, version) of every document served."""
+    digest = hashlib.sha256(f"{API_PREFIX}|{user_id}|{full_path}".encode())
+    for doc_id, version in versions:
+        digest.update(f"|{doc_id}:{version}".encode())
+    return digest.hexdigest()[:32]
+
+def batch_payload(docs, ids, fields):
+    """?ids= results in the requested order, plus the ids that were not found."""
+    found = {doc['_id']: doc for doc in docs}
+    return {
+        'data': [api_document(found[doc_id], fields) for doc_id in ids if doc_id in found],
+        'missing': [doc_id for doc_id in ids if doc_id not in found]
+    }
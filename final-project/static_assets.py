@@ -0,0 +1,119 @@
+import os
+import json
+import gzip
+import shutil
+import hashlib
+
+try:
+    import brotli
+except ImportError:  # brotli variants are skipped; gzip comes from the standard library
+    brotli = None
+
+# --- Asset Settings ---
+ASSETS_DIR = 'assets'
+MANIFEST_NAME = 'manifest.json'
+# Generated elsewhere (already content-hashed) or by this build itself
+SKIPPED_DIRS = (ASSETS_DIR, 'images/derived')
+# Text formats worth precompressing; images are already compressed
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.html', '.txt', '.json', '.xml', '.map'}
+# A variant is only kept if it saves at least this fraction of the original size
+MIN_SAVING = 0.1
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def _source_files(static_folder):
+    for root, dirs, files in os.walk(static_folder):
+        rel_root = os.path.relpath(root, static_folder).replace(os.sep, '/')
+        dirs[:] = sorted(
+            d for d in dirs
+            if (d if rel_root == '.' else f"{rel_root}/{d}") not in SKIPPED_DIRS
+        )
+        for name in sorted(files):
+            yield name if rel_root == '.' else f"{rel_root}/{name}"
+
+
+def _write_variants(path, data):
+    """Writes .br/.gz next to path when they are meaningfully smaller; returns the encodings."""
+    encodings = []
+    compressors = [('gzip', '.gz', lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        compressors.insert(0, ('br', '.br', lambda d: brotli.compress(d, quality=11)))
+    for encoding, suffix, compress in compressors:
+        compressed = compress(data)
+        if len(compressed) <= len(data) * (1 - MIN_SAVING):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+            encodings.append(encoding)
+    return encodings
+
+
+def build_assets(static_folder):
+    """
+    Copies every static file to ASSETS_DIR under a name containing its content
+    hash, writes brotli/gzip variants of text files, and writes a manifest
+    mapping each original path to its fingerprinted copy. Files with identical
+    content share one copy.
+    """
+    out_dir = os.path.join(static_folder, ASSETS_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+
+    manifest = {}
+    built = {}  # (digest, extension) -> manifest entry, so duplicate content is written once
+    for filename in _source_files(static_folder):
+        source = os.path.join(static_folder, filename)
+        stem, ext = os.path.splitext(os.path.basename(filename))
+        key = (_file_digest(source), ext.lower())
+        if key not in built:
+            hashed_name = f"{stem}.{key[0]}{ext}"
+            target = os.path.join(out_dir, hashed_name)
+            if not os.path.exists(target):
+                shutil.copyfile(source, target)
+            encodings = []
+            if key[1] in COMPRESSIBLE_EXTENSIONS:
+                with open(source, 'rb') as f:
+                    encodings = _write_variants(target, f.read())
+            built[key] = {'path': f"{ASSETS_DIR}/{hashed_name}", 'encodings': encodings}
+        manifest[filename] = built[key]
+
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_folder):
+    """Returns the asset manifest, or an empty dict if it has not been built."""
+    path = os.path.join(static_folder, ASSETS_DIR, MANIFEST_NAME)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def fingerprinted_path(manifest, filename):
+    """Returns the fingerprinted path for a static filename, or filename if it has none."""
+    entry = manifest.get(filename)
+    return entry['path'] if entry else filename
+
+
+def precompressed_variant(encodings_by_path, filename, accept_encodings):
+    """
+    Picks the best precompressed variant of an asset the client accepts.
+    Returns (filename_to_send, content_encoding), with encoding None for the original.
+    """
+    for encoding in encodings_by_path.get(filename, ()):
+        if accept_encodings[encoding]:
+            return f"{filename}{'.br' if encoding == 'br' else '.gz'}", encoding
+    return filename, None
+
+
+def encodings_by_path(manifest):
+    """Maps each fingerprinted path to its available encodings, for serving."""
+    return {entry['path']: entry['encodings'] for entry in manifest.values()}
@@ -0,0 +1,168 @@
+import os
+import time
+import threading
+from collections import deque
+
+
+class WriteBehindBuffer:
+    """
+    Bounded in-process queue of items written in batches by a background
+    thread. A batch is flushed once flush_size items are waiting or the oldest
+    has waited flush_interval seconds. flush_fn(items) does the write; a failed
+    batch is put back and retried with backoff.
+
+    claim(key) coalesces repeated actions: it fails for a key that was claimed
+    less than coalesce_window seconds ago. release(key) gives the claim back
+    when the claimed action did not happen.
+    """
+
+    def __init__(self, flush_fn, flush_size=200, flush_interval=1.0, capacity=10000,
+                 coalesce_window=0):
+        self.flush_fn = flush_fn
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.capacity = capacity
+        self.coalesce_window = coalesce_window
+        self.flushed = 0
+        self.failures = 0
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Also runs in a forked child: the parent's thread and locks do not carry over
+        self._items = deque()
+        self._in_flight = []
+        self._recent = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        self._oldest = None
+        self._thread = None
+        self._closed = False
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    # --- Producers ---
+
+    def claim(self, key):
+        """Returns False if key was claimed within coalesce_window seconds, else claims it."""
+        with self._lock:
+            now = time.monotonic()
+            last = self._recent.get(key)
+            if last is not None and now - last < self.coalesce_window:
+                return False
+            self._recent[key] = now
+            if len(self._recent) > self.capacity:
+                self._recent = {k: t for k, t in self._recent.items() if now - t < self.coalesce_window}
+            return True
+
+    def release(self, key):
+        """Drops a claim, so the next claim(key) succeeds."""
+        with self._lock:
+            self._recent.pop(key, None)
+
+    def add(self, item):
+        """Queues an item; returns False if the queue is full and the caller must write it itself."""
+        with self._lock:
+            if self._closed or len(self._items) >= self.capacity:
+                return False
+            if not self._items:
+                self._oldest = time.monotonic()
+            self._items.append(item)
+            self._ensure_worker()
+            if len(self._items) >= self.flush_size:
+                self._ready.notify()
+        return True
+
+    def pending(self, predicate):
+        """Items not yet written (queued or being written) that match predicate."""
+        with self._lock:
+            return [item for item in list(self._in_flight) + list(self._items) if predicate(item)]
+
+    def discard(self, predicate):
+        """Drops queued items matching predicate, after any batch being written has finished."""
+        with self._write_lock, self._lock:
+            kept = [item for item in self._items if not predicate(item)]
+            dropped = len(self._items) - len(kept)
+            self._items = deque(kept)
+            return dropped
+
+    # --- Writing ---
+
+    def _take_batch(self, limit):
+        batch = []
+        while self._items and len(batch) < limit:
+            batch.append(self._items.popleft())
+        self._oldest = time.monotonic() if self._items else None
+        self._in_flight = batch
+        return batch
+
+    def _write(self, batch):
+        try:
+            self.flush_fn(batch)
+            self.flushed += len(batch)
+            return True
+        except Exception as e:
+            self.failures += 1
+            print(f"Error writing {len(batch)} buffered items: {e}")
+            with self._lock:
+                self._items.extendleft(reversed(batch))
+                self._oldest = time.monotonic()
+            return False
+        finally:
+            with self._lock:
+                self._in_flight = []
+
+    def _run(self):
+        backoff = 0
+        while True:
+            with self._lock:
+                while not self._closed:
+                    if self._items and (
+                        len(self._items) >= self.flush_size
+                        or time.monotonic() - self._oldest >= self.flush_interval
+                    ):
+                        break
+                    timeout = None
+                    if self._items:
+                        timeout = max(0, self.flush_interval - (time.monotonic() - self._oldest))
+                    self._ready.wait(timeout)
+                if self._closed:
+                    return
+            with self._write_lock:
+                with self._lock:
+                    batch = self._take_batch(self.flush_size)
+                ok = not batch or self._write(batch)
+            if ok:
+                backoff = 0
+            else:
+                backoff = min(30, max(1, backoff * 2))
+                time.sleep(backoff)
+
+    def flush(self):
+        """Writes everything queued so far, in the calling thread."""
+        with self._write_lock:
+            while True:
+                with self._lock:
+                    batch = self._take_batch(self.flush_size)
+                if not batch or not self._write(batch):
+                    return
+
+    def close(self):
+        """Stops the worker and writes what is left; used at shutdown."""
+        with self._lock:
+            self._closed = True
+            self._ready.notify_all()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {'queued': len(self._items), 'in_flight': len(self._in_flight),
+                    'flushed': self.flushed, 'failures': self.failures}
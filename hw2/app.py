@@ -1,12 +1,35 @@
+import time
 from flask import Flask, render_template, request, redirect, url_for, session, flash
-from flask_mysqldb import MySQL
+from mysql.connector import errors
 # Asumo que tu config.py tiene SECRET_KEY y las credenciales de MySQL
 from config import Config
+import db_pool
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
-mysql = MySQL(app)
+pool = db_pool.ConnectionPool(app)
+
+# Profile data kept in the session is trusted for this many seconds before re-reading it
+PROFILE_SESSION_TTL = app.config.get('PROFILE_SESSION_TTL', 300)
+
+
+def remember_profile(user):
+    session['profile'] = {'username': user['username'], 'email': user['email']}
+    session['profile_loaded_at'] = time.time()
+
+
+def cached_profile():
+    loaded_at = session.get('profile_loaded_at', 0)
+    if 'profile' in session and time.time() - loaded_at < PROFILE_SESSION_TTL:
+        return session['profile']
+    return None
+
+
+@app.errorhandler(errors.PoolError)
+def database_busy(e):
+    flash('The server is busy, please try again in a moment.', 'warning')
+    return render_template('base.html'), 503
 
 
 @app.route('/')
@@ -25,16 +48,11 @@ def register():
             flash('The passwords do not match.', 'danger')
             return redirect(url_for('register'))
 
-        cur = mysql.connection.cursor()
-        cur.execute("SELECT * FROM users WHERE username = %s OR email = %s", (username, email))
-        if cur.fetchone():
+        if db_pool.user_exists(pool, username, email):
             flash('The username or email already exists.', 'danger')
             return redirect(url_for('register'))
 
-        cur.execute("INSERT INTO users (username, email, password) VALUES (%s, %s, %s)",
-                      (username, email, password))
-        mysql.connection.commit()
-        cur.close()
+        db_pool.create_user(pool, username, email, password)
 
         flash('Registration successful. You can now log in.', 'success')
         return redirect(url_for('login'))
@@ -47,15 +65,13 @@ def login():
         email = request.form['email']
         password_candidate = request.form['password']
 
-        cur = mysql.connection.cursor()
-        cur.execute("SELECT * FROM users WHERE email = %s", (email,))
-        user = cur.fetchone()
-        cur.close()
+        user = db_pool.get_login_by_email(pool, email)
 
         if user and (password_candidate == user['password']):
             session['logged_in'] = True
             session['username'] = user['username']
             session['user_id'] = user['id']  
+            remember_profile(user)
 
             flash('Welcome ' + user['username'], 'success')
             return redirect(url_for('profile'))
@@ -67,10 +83,14 @@ def login():
 @app.route('/profile')
 def profile():
     if 'logged_in' in session:
-        cur = mysql.connection.cursor()
-        cur.execute("SELECT * FROM users WHERE id = %s", (session['user_id'],))
-        user = cur.fetchone()
-        cur.close()
+        user = cached_profile()
+        if user is None:
+            user = db_pool.get_user_by_id(pool, session['user_id'])
+            if user is None:
+                session.clear()
+                flash('Your account no longer exists.', 'warning')
+                return redirect(url_for('login'))
+            remember_profile(user)
         return render_template('profile.html', user=user)
     else:
         flash('You must be logged in to view this page.', 'warning')
@@ -91,27 +111,21 @@ def update_profile():
     
     # Obtenemos el ID del usuario desde la sesión
     user_id = session['user_id']
-    cur = mysql.connection.cursor()
     
     if request.method == 'POST':
         new_username = request.form['username']
         new_email = request.form['email']
 
-        cur.execute(
-            "UPDATE users SET username = %s, email = %s WHERE id = %s",
-            (new_username, new_email, user_id)
-        )
-        mysql.connection.commit()
+        db_pool.update_user(pool, user_id, new_username, new_email)
         
         session['username'] = new_username
+        remember_profile({'username': new_username, 'email': new_email})
 
         flash('Your profile has been updated successfully.', 'success')
         return redirect(url_for('profile'))
 
     # If the method is GET, show the form with the current data
-    cur.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-    user = cur.fetchone()
-    cur.close()
+    user = cached_profile() or db_pool.get_user_by_id(pool, user_id)
     return render_template('update_profile.html', user=user)
 
 @app.route('/delete_profile', methods=['POST'])
@@ -121,12 +135,7 @@ def delete_profile():
         return redirect(url_for('login'))
 
     user_id = session['user_id']
-    cur = mysql.connection.cursor()
-    
-    cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
-    mysql.connection.commit()
-    cur.close()
-    
+    db_pool.delete_user(pool, user_id)
     session.clear()
 
     flash('Your account has been permanently deleted.', 'info')
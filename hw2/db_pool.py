@@ -0,0 +1,115 @@
+import threading
+from contextlib import contextmanager
+from mysql.connector import pooling, errors
+
+# Columns the app actually reads; never SELECT * so schema changes don't widen every query
+USER_COLUMNS = "id, username, email, created_at"
+
+
+class ConnectionPool:
+    """
+    Bounded pool of MySQL connections. Callers wait up to `timeout` seconds
+    for a free connection, and every connection is pinged before it is handed out.
+    """
+
+    def __init__(self, app=None):
+        self._pool = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self.timeout = 5
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._config = {
+            'host': app.config.get('MYSQL_HOST', 'localhost'),
+            'port': int(app.config.get('MYSQL_PORT', 3306)),
+            'user': app.config.get('MYSQL_USER'),
+            'password': app.config.get('MYSQL_PASSWORD'),
+            'database': app.config.get('MYSQL_DB'),
+        }
+        self.size = int(app.config.get('MYSQL_POOL_SIZE', 5))
+        self.timeout = float(app.config.get('MYSQL_POOL_TIMEOUT', 5))
+
+    def _get_pool(self):
+        # Created on first use so importing the app never opens a connection
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._slots = threading.BoundedSemaphore(self.size)
+                    self._pool = pooling.MySQLConnectionPool(
+                        pool_name='flask_users',
+                        pool_size=self.size,
+                        pool_reset_session=True,
+                        **self._config
+                    )
+        return self._pool
+
+    @contextmanager
+    def connection(self):
+        pool = self._get_pool()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise errors.PoolError('Timed out waiting for a database connection.')
+        conn = None
+        try:
+            conn = pool.get_connection()
+            # Health check: reconnect a connection the server dropped while it sat idle
+            conn.ping(reconnect=True, attempts=2, delay=0)
+            yield conn
+        finally:
+            if conn is not None:
+                conn.close()  # returns it to the pool
+            self._slots.release()
+
+    @contextmanager
+    def cursor(self, commit=False):
+        """Yields a prepared-statement cursor that is always closed, committing on success if asked."""
+        with self.connection() as conn:
+            cur = conn.cursor(prepared=True, dictionary=True)
+            try:
+                yield cur
+                if commit:
+                    conn.commit()
+            except Exception:
+                if commit:
+                    conn.rollback()
+                raise
+            finally:
+                cur.close()
+
+
+# --- User Queries ---
+
+def get_user_by_id(pool, user_id):
+    with pool.cursor() as cur:
+        cur.execute(f"SELECT {USER_COLUMNS} FROM users WHERE id = %s", (user_id,))
+        return cur.fetchone()
+
+
+def get_login_by_email(pool, email):
+    with pool.cursor() as cur:
+        cur.execute(f"SELECT {USER_COLUMNS}, password FROM users WHERE email = %s", (email,))
+        return cur.fetchone()
+
+
+def user_exists(pool, username, email):
+    with pool.cursor() as cur:
+        cur.execute("SELECT id FROM users WHERE username = %s OR email = %s LIMIT 1", (username, email))
+        return cur.fetchone() is not None
+
+
+def create_user(pool, username, email, password):
+    with pool.cursor(commit=True) as cur:
+        cur.execute("INSERT INTO users (username, email, password) VALUES (%s, %s, %s)",
+                    (username, email, password))
+
+
+def update_user(pool, user_id, username, email):
+    with pool.cursor(commit=True) as cur:
+        cur.execute("UPDATE users SET username = %s, email = %s WHERE id = %s",
+                    (username, email, user_id))
+
+
+def delete_user(pool, user_id):
+    with pool.cursor(commit=True) as cur:
+        cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
@@ -1,4 +1,5 @@
 import os
+import threading
 from flask import Flask, render_template, request, redirect, url_for
 from pymongo import MongoClient
 from bson.objectid import ObjectId
@@ -7,13 +8,36 @@ from datetime import datetime
 app = Flask(__name__)
 
 mongo_uri = os.getenv('MONGO_URI')
-client = MongoClient(mongo_uri)
-db = client.plant_watering_db  
-plants_collection = db.plants
+# (pid, client) of the process that created the client, swapped in as one value
+mongo_client = None
+mongo_client_lock = threading.Lock()
+
+def mongo_client_options():
+    options = {
+        'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', 100)),
+        'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 30000)),
+        'connectTimeoutMS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 20000)),
+    }
+    if os.getenv('MONGO_COMPRESSORS'):
+        options['compressors'] = os.getenv('MONGO_COMPRESSORS')
+    return options
+
+def get_plants_collection():
+    # The client is created on first use in each process, so workers forked by a
+    # pre-forking server never share the parent's connection pool. The lock is
+    # only taken until this process has its client.
+    global mongo_client
+    client = mongo_client
+    if client is None or client[0] != os.getpid():
+        with mongo_client_lock:
+            client = mongo_client
+            if client is None or client[0] != os.getpid():
+                client = mongo_client = (os.getpid(), MongoClient(mongo_uri, **mongo_client_options()))
+    return client[1].plant_watering_db.plants
 
 @app.route('/')
 def index():
-    all_plants = plants_collection.find()
+    all_plants = get_plants_collection().find()
     all_plants = list(all_plants)
     return render_template('index.html', plants=all_plants)
 
@@ -42,7 +66,7 @@ def add_plant():
             'image_url': plant_image_url,
             'created_at': datetime.now()
         }
-        plants_collection.insert_one(plant_document)
+        get_plants_collection().insert_one(plant_document)
 
         return redirect(url_for('index'))
 
@@ -62,7 +86,7 @@ def water_plant(plant_id):
             }
         }
         
-        plants_collection.update_one(filter_query, update_operation)
+        get_plants_collection().update_one(filter_query, update_operation)
         
     except Exception as e:
         print(f"Error when watering a plant: {e}")
@@ -74,7 +98,7 @@ def delete_plant(plant_id):
     try:
         plant_id_obj = ObjectId(plant_id)
         
-        plants_collection.delete_one({'_id': plant_id_obj})
+        get_plants_collection().delete_one({'_id': plant_id_obj})
         
     except Exception as e:
         print(f"Error deleting the plant: {e}")
@@ -92,7 +116,7 @@ def delete_multiple():
             object_ids = [ObjectId(pid) for pid in plant_ids]
             
             # Eliminar todos los documentos que coincidan con esos IDs
-            plants_collection.delete_many({'_id': {'$in': object_ids}})
+            get_plants_collection().delete_many({'_id': {'$in': object_ids}})
             
     except Exception as e:
         print(f"Error deleting multiple plants: {e}")